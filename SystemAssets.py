@@ -8,29 +8,51 @@
 
 import numpy as np
 import datetime as dt
-import pytz
+import glob
+import gzip
+import json
+import os
+import re
+import threading
+import time
 from collections import OrderedDict
-import influxdb
+# influxdb and pytz are imported where used, scripts that only
+# build svgs or parse files do not pay for them at import.
+
+# Parsed files and clients kept for the life of the process, so a resident
+# service (see recs_service.py) only reads and connects once.
+_asset_fields = {}
+_clients = {}
+_storage_curves = {}
+_registries = {}
 
 def get_asset_fields(filename):
     # Get asset fields from csv file. 
     # Return in dict['MEASURE'] = [fields]
     # Assets fields detail what fields and measured can be queried.
     # See './csv/GLWA_infdb_data_structures.csv' for example.
-    asset_fields = {}
-    with open(filename) as f:
-        for l in f.readlines()[1:]:
-            l = l.rstrip().split(',')
-            asset_fields[l[0]] = []
-            for i in l[1:]:
-                if len(i) > 1 and i != 'SITE':
-                    asset_fields[l[0]].append(i.rstrip())
-                    
-    return asset_fields
+    if filename not in _asset_fields:
+        asset_fields = {}
+        with open(filename) as f:
+            for l in f.readlines()[1:]:
+                l = l.rstrip().split(',')
+                asset_fields[l[0]] = []
+                for i in l[1:]:
+                    if len(i) > 1 and i != 'SITE':
+                        asset_fields[l[0]].append(i.rstrip())
+        _asset_fields[filename] = asset_fields
+    
+    # copy, callers are free to change their lists
+    return {m: list(f) for m,f in _asset_fields[filename].items()}
 
 def connection(connection_file):
     # Make and return influxDB client object
     # Define connection details in './csv/Influx_Connect_File.csv'
+    # The client is reused by later calls with the same file.
+    if connection_file in _clients:
+        return _clients[connection_file]
+    
+    import influxdb
     d = {}
 
     with open(connection_file) as f:
@@ -46,13 +68,15 @@ def connection(connection_file):
         username=d['username'],
         password=d['password']
     )
-
+    
+    _clients[connection_file] = influx_connection
     return influx_connection 
 
 def time_return(*args):
     # ---- About ----
     # Convert datetime type in utc and convert to nanosecond since epoch.
     # Return tuple of nanoseconds and string of time
+    import pytz
     
     t = dt.datetime.utcnow()
 
@@ -72,6 +96,47 @@ def time_return(*args):
     # return time tuple
     return (nano, t_simple_string)
 
+def get_storage_curves(filename):
+    # Depth-volume curves saved by storage_curves.save(), read once.
+    # Return a storage_curves object (a copy, callers may add to it).
+    if filename not in _storage_curves:
+        _storage_curves[filename] = storage_curves.load(filename)
+    return storage_curves(_storage_curves[filename].curves)
+
+def get_registry(filename, asset_fields):
+    # Asset registry of a config file, loaded and validated once.
+    key = (filename, json.dumps(asset_fields, sort_keys=True))
+    if key not in _registries:
+        _registries[key] = registry(filename, asset_fields)
+    return _registries[key]
+
+def split_results(query_return):
+    # ---- About ----
+    # client.query() hands back a single ResultSet for one statement and a
+    # list of ResultSets for a multi-statement (';' separated) query.
+    # Always return a list, one entry per statement.
+    if isinstance(query_return, list):
+        return query_return
+    return [query_return]
+
+def last_value(result):
+    # ---- About ----
+    # Return the [time, value] pair of a 'SELECT last(...)' ResultSet.
+    # None if the statement came back without a series (no data).
+    series = result.raw.get('series')
+    if not series:
+        return None
+    return series[0]['values'][0]
+
+def last_by_tag(result,tag):
+    # ---- About ----
+    # Return {tag value: [time, value]} from a 'SELECT last(...) ... GROUP BY tag'
+    # ResultSet, one entry per series. {} if the statement came back empty.
+    by_tag = {}
+    for series in result.raw.get('series',[]):
+        by_tag[series['tags'][tag]] = series['values'][0]
+    return by_tag
+
 def calc_avail(v,pump,t):
     # ---- About ----
     # Used iteratively to determine the amount of time to recommend for each
@@ -109,18 +174,43 @@ class asset():
         for f in fields:
             self.fields[f] = ''
         
-    def query_measures(self,client):
+    def query_statement(self,field):
+        return "SELECT last({0}) FROM {1} WHERE SITE='{2}'".format(field,self.measure,self.name)
+
+    def query_measures(self,client,batch=False,chunk_size=20):
         # ----- About ---- 
         # Given fields, query last value.
-        # Store in dictionary
+        # Store in dictionary as [time, value]
+        # batch=True joins the statements of up to chunk_size fields into a
+        # single multi-statement request, instead of one request per field.
+        # Return a list of fields that came back empty, [] if none. Empty
+        # fields are left as '' in self.fields.
         
-        for f in self.fields:
-            query_str = "SELECT last({0}) FROM {1} WHERE SITE='{2}'".format(f,self.measure,self.name)
+        if not batch:
+            chunk_size = 1
+        
+        self.empty_fields = []
+        fields = list(self.fields)
+        for i in range(0,len(fields),chunk_size):
+            chunk = fields[i:i+chunk_size]
+            query_str = ';'.join([self.query_statement(f) for f in chunk])
             # print(query_str)
             query_return = client.query(query_str)
-            # print(query_return)
-            series = query_return.raw['series'][0]
-            self.fields[f] = series['values'][0]  
+            
+            for f,result in zip(chunk,split_results(query_return)):
+                self.store_last(f,result)
+                
+        return self.empty_fields
+    
+    def store_last(self,field,result):
+        # Store a 'SELECT last(field)' ResultSet as [time, value].
+        # Fields without data are recorded in self.empty_fields.
+        values = last_value(result)
+        if values is None:
+            self.fields[field] = ''
+            self.empty_fields.append(field)
+        else:
+            self.fields[field] = values
             
     def write_rec(self,client, *extra): 
         # ---- About ---- 
@@ -203,15 +293,19 @@ class pumpstation(asset):
     
     
     # ---- Pumps and Wet Wells Functions ----        
-    def pump_dict(self):
+    def pump_dict(self, rows=None):
         # self.pumps is a container for Pump objects of the pumps in the pumpstation
         # see Pump class for more on pump objects.
+        # rows: [name, flowrate, group] of each pump (eg. from a registry),
+        # default read from the station's _PUMP_FLOWS.csv file.
         self.pumps = OrderedDict()
-            
-        with open('/home/ubuntu/RT_Recs/csv/{0}_PUMP_FLOWS.csv'.format(self.measure),'r') as f:
-            for l in f:
-                s = l.strip().split(',')
-                self.pumps[s[0]] = Pump(s)
+        
+        if rows is None:
+            with open('/home/ubuntu/RT_Recs/csv/{0}_PUMP_FLOWS.csv'.format(self.measure),'r') as f:
+                rows = [l.strip().split(',') for l in f]
+        
+        for s in rows:
+            self.pumps[s[0]] = Pump(s)
                 
     def pumps_running(self):
         # Count how many pumps are currently running for
@@ -223,12 +317,23 @@ class pumpstation(asset):
             # print(p, self.fields[p][1])
         self.running = running
         
-    def pumps_recommended(self,client):
+    def pumps_recommended(self,client,grouped=False):
         # Used with building the 'recommended.svg' layer.
         # Query and counts the number of pumps to be used.
         # Must already have called self.pump_dict() method
+        # grouped=True gets every pump with one 'GROUP BY PUMP' query.
         self.recommended = {'ST':0,'SN':0}
         
+        if grouped:
+            q_str = "SELECT last(REC_BOOL) FROM {0} GROUP BY PUMP".format(self.measure)
+            by_pump = last_by_tag(client.query(q_str),'PUMP')
+            
+            for p in self.pumps:
+                if p in by_pump:
+                    self.pumps[p].status = by_pump[p]
+                    self.recommended[p[:2]] = self.recommended[p[:2]] + self.pumps[p].status[1]
+            return
+        
         for p in self.pumps:
             q_str  = "SELECT last(REC_BOOL) FROM {0} WHERE PUMP='{1}'".format(self.measure,p)
             query_return = client.query(q_str)
@@ -241,6 +346,16 @@ class pumpstation(asset):
                 self.pumps[p].status = series['values'][0]            
                 self.recommended[p[:2]] = self.recommended[p[:2]] + self.pumps[p].status[1]
     
+    def count_recommended(self):
+        # Counts the number of pumps recommended ON from the pump
+        # recommendations set this cycle (see CombinedMBC.py), without
+        # querying them back from influxDB.
+        self.recommended = {'ST':0,'SN':0}
+        
+        for p in self.pumps:
+            if isinstance(self.pumps[p].rec,dict):
+                self.recommended[p[:2]] = self.recommended[p[:2]] + self.pumps[p].rec['REC_BOOL']
+    
     def write_pump_recs(self, client, *extra):
         # Write recommendations associated with pumps at station to DB
         # Return a list of lines that failed to write to influxDB, [] empty if none failed
@@ -279,11 +394,21 @@ class pumpstation(asset):
         for i in range(0,num_gates):
             self.open_gates = self.open_gates + self.fields[name_str+str(i+1)][1]
             
-    def gates_recommended(self,client):
+    def gates_recommended(self,client,grouped=False):
         # Used with building the 'recommended.svg' layer.
         # Query and counts the number of gates to be used.
+        # grouped=True gets every gate with one 'GROUP BY GATE' query.
         self.recommended['SWR_GATE'] = 0
         
+        if grouped:
+            q_str = "SELECT last(REC_BOOL) FROM {0} GROUP BY GATE".format(self.measure)
+            by_gate = last_by_tag(client.query(q_str),'GATE')
+            
+            for gate in [key for key in self.fields if 'GATE' in key]:
+                if gate in by_gate:
+                    self.recommended['SWR_GATE'] = self.recommended['SWR_GATE'] + by_gate[gate][1]
+            return
+        
         for gate in [key for key in self.fields if 'GATE' in key]:
             q_str = "SELECT last(REC_BOOL) FROM {0} WHERE GATE='{1}'".format(self.measure,gate)
             query_return = client.query(q_str)
@@ -333,17 +458,115 @@ class Gate():
         self.name = 'SWR_GATE_'
         self.location = 'UNKNOWN'
         
+# Depth -> area of partly full conduits. Normalized depth (depth/height)
+# to the filled fraction of the full area, tabulated once per shape.
+_fill_depth = np.linspace(0.0, 1.0, 1001)
+
+def egg_half_width(y):
+    # Standard egg of height 3: top arc radius 1, invert arc radius 0.5,
+    # side arcs radius 3 centered at (+-2, 2).
+    return np.where(y < 0.2, np.sqrt(np.maximum(0.25 - (y - 0.5)**2, 0.0)),
+        np.where(y < 2.0, np.sqrt(9.0 - (y - 2.0)**2) - 2.0,
+            np.sqrt(np.maximum(1.0 - (y - 2.0)**2, 0.0))))
+
+def fill_tables():
+    theta = 2.0 * np.arccos(1.0 - 2.0 * _fill_depth)
+    
+    # egg: integrate the width on a fine grid, keep the table points
+    y = np.linspace(0.0, 3.0, 30001)
+    w = 2.0 * egg_half_width(y)
+    a = np.concatenate([[0.0], np.cumsum((w[1:] + w[:-1]) / 2.0 * np.diff(y))])
+    
+    tables = {
+        'CIRCULAR': (theta - np.sin(theta)) / (2.0 * np.pi),
+        'RECT': _fill_depth.copy(),
+        'EGG': np.interp(_fill_depth * 3.0, y, a) / a[-1],
+    }
+    # full area as a fraction of height**2, rectangles are height * width
+    full = {'CIRCULAR': np.pi / 4.0, 'EGG': a[-1] / 9.0}
+    return tables, full
+
+_fill_area, _full_area = fill_tables()
+
+def check_shapes(shape):
+    # Raise ValueError for shapes without a fill table
+    unknown = set(np.unique(shape).tolist()) - set(_fill_area)
+    if unknown:
+        raise ValueError('Unknown conduit shape(s) {0}, expected one of {1}'.format(
+            ', '.join(sorted(map(str, unknown))), ', '.join(sorted(_fill_area))))
+
+def area_full(height, shape='CIRCULAR', width=None):
+    # Full cross section area of conduits, arrays or scalars. Egg width is
+    # 2/3 of the height, circles are height wide.
+    height = np.asarray(height, dtype=float)
+    shape = np.asarray(shape)
+    check_shapes(shape)
+    if width is None:
+        width = height
+    
+    area = height * np.asarray(width, dtype=float)
+    for s in _full_area:
+        area = np.where(shape == s, _full_area[s] * height**2, area)
+    return area
+
+def percent_full(depth, height, shape='CIRCULAR'):
+    # Fraction of the full area filled at depth, for any number of conduits
+    # at once. depth, height, shape: arrays (or scalars) of the same shape.
+    # Depths are clamped to [0, height].
+    y = np.clip(np.asarray(depth, dtype=float) / np.asarray(height, dtype=float), 0.0, 1.0)
+    shape = np.asarray(shape)
+    check_shapes(shape)
+    
+    pa = np.zeros(np.broadcast(y, shape).shape)
+    for s in _fill_area:
+        pa = np.where(shape == s, np.interp(y, _fill_depth, _fill_area[s]), pa)
+    return pa
+
+def sewer_meter_calcs(meters):
+    # timestep_calcs() of many sewer meters in one pass: normalized depth,
+    # area_max and percent_area of each.
+    level = np.array([m.fields['LEVEL'][1] for m in meters], dtype=float)
+    height = np.array([m.depth_max for m in meters], dtype=float)
+    width = np.array([m.width if m.width is not None else m.depth_max for m in meters], dtype=float)
+    shape = np.array([m.shape for m in meters])
+    
+    area_max = area_full(height, shape, width)
+    pa = percent_full(level, height, shape)
+    
+    for m,d,a,p in zip(meters, level / height, area_max, pa):
+        m.fields['LEVEL'].append(d)
+        m.area_max = a
+        m.percent_area = [m.fields['LEVEL'][0], p]
+
+
 class sewer_meter(asset):
     # Asset subclass. Used with GLWA Sewer Meters assets.
+    # kwargs:
+    #   shape: 'CIRCULAR' (default), 'RECT' or 'EGG' conduit at the meter
+    #   width: width of a 'RECT' conduit, default depth_max
     def __str__(self):
         return "METER: " + super().__str__()
     
     def __init__(self, name, measure, fields, *args, **kwargs):
         super().__init__(name,measure,fields)
+        self.shape = 'CIRCULAR'
+        self.width = None
         
-    def every_timestep(self,client):
+        self.kwargs = kwargs
+        kw = self.kwargs.keys()
+        if 'shape' in kw:
+            self.shape = self.kwargs['shape']
+        if 'width' in kw:
+            self.width = self.kwargs['width']
+        
+    def every_timestep(self,client,batch=False):
         # Perform query and calculations altogether.
-        super().query_measures(client)
+        super().query_measures(client,batch)
+        self.timestep_calcs()
+        
+    def timestep_calcs(self):
+        # Calculations done after the fields are queried (or hydrated
+        # from a snapshot).
         self.normalized_depth()
         self.calc_area_max()
         self.calc_percent_area()
@@ -355,30 +578,15 @@ class sewer_meter(asset):
         
     def calc_area_max(self):
         # Calculate the area of the conduit at meter location.
-        # *Assume* circular conduit...
-        self.area_max = np.pi * ( self.depth_max / 2 ) ** 2
+        self.area_max = float(area_full(self.depth_max, self.shape, self.width))
         
     def calc_percent_area(self):
         # Determine the percent of total area of sewer that is filled.
-        # Again, assumes circular conduit. Uses geometry of circles to
-        # estimate the area occupied.
-        # % = A_currentCrossSection / A_max
-        r = self.depth_max / 2
+        # % = A_currentCrossSection / A_max, see percent_full()
         h = self.fields['LEVEL'][1]
         t = self.fields['LEVEL'][0]
         
-        # If depth is greater than half the pipe:
-        if h > r:
-            h = self.depth_max - self.fields['LEVEL'][1]
-            theta = 2 * np.arccos((r-h)/r)
-            A = np.pi * r**2 - (r**2 * ( theta - np.sin(theta)))/2
-            
-        # Depth less than half the pipe:
-        else:
-            theta = 2 * np.arccos((r-h)/r)
-            A = (r**2 * (theta - np.sin(theta))) / 2
-            
-        pa = A / self.area_max
+        pa = float(percent_full(h, self.depth_max, self.shape))
         self.percent_area = [t, pa]
         
     def calc_dcost(self,*args):
@@ -427,6 +635,542 @@ class valve(asset):
         super().__init__(name,measure,fields)
         
     
+class storage_curves():
+    # ---- About ----
+    # Depth <-> volume lookup of storages (wet wells, basins), one table of
+    # depths [ft] and cumulative volumes [ft^3] per storage name. Tables
+    # come from swmmAPI_v2.swmmINP.storage_curves() (built from the SWMM
+    # TABULAR/FUNCTIONAL storage curves) or add_prismatic() for a constant
+    # surface area. Lookups take scalars or arrays and are linear between
+    # table points and past either end, so a prismatic table gives the same
+    # volumes as depth * area.
+    def __str__(self):
+        return "Storage curves: " + ', '.join(sorted(self.curves))
+    
+    def __init__(self, curves=None, *args, **kwargs):
+        # curves: dict[name] = (depths, volumes)
+        self.curves = {}
+        if curves:
+            for name in curves:
+                self.add(name, curves[name][0], curves[name][1])
+    
+    def add(self, name, depth, volume):
+        self.curves[name] = (np.asarray(depth, dtype=float), np.asarray(volume, dtype=float))
+    
+    def add_prismatic(self, name, area, max_depth):
+        self.add(name, [0.0, max_depth], [0.0, area * max_depth])
+    
+    def lookup(self, x, xp, fp):
+        # np.interp extended with the end slopes
+        x = np.asarray(x, dtype=float)
+        y = np.interp(x, xp, fp)
+        lo = (fp[1] - fp[0]) / (xp[1] - xp[0])
+        hi = (fp[-1] - fp[-2]) / (xp[-1] - xp[-2])
+        y = np.where(x < xp[0], fp[0] + (x - xp[0]) * lo, y)
+        y = np.where(x > xp[-1], fp[-1] + (x - xp[-1]) * hi, y)
+        return y if y.ndim else float(y)
+    
+    def depth_to_volume(self, name, depth):
+        depths, volumes = self.curves[name]
+        return self.lookup(depth, depths, volumes)
+    
+    def volume_to_depth(self, name, volume):
+        depths, volumes = self.curves[name]
+        return self.lookup(volume, volumes, depths)
+    
+    def max_volume(self, name):
+        return float(self.curves[name][1][-1])
+    
+    def free_volume(self, name, depth):
+        # Volume left between depth and the top of the table
+        return self.max_volume(name) - self.depth_to_volume(name, depth)
+    
+    def save(self, filename, names=None):
+        # names: dict[curve name] = name to save it under, eg. SWMM storage
+        # node -> asset name. If given, only those curves are saved.
+        if names is None:
+            names = {n: n for n in self.curves}
+        missing = [n for n in names if n not in self.curves]
+        if missing:
+            raise ValueError('No storage curve for: ' + ', '.join(sorted(missing)))
+        
+        curves = {names[n]: [d.tolist(), v.tolist()] for n,(d,v) in self.curves.items() if n in names}
+        tmp = filename + '.tmp'
+        with open(tmp,'w') as f:
+            json.dump(curves,f)
+        os.replace(tmp,filename)
+    
+    @staticmethod
+    def load(filename):
+        with open(filename) as f:
+            return storage_curves(json.load(f))
+
+
+class registry():
+    # ---- About ----
+    # Assets declared in a json config file: site, measure, asset class,
+    # physical attributes, MBC parameters (u_param, d_param, set_point),
+    # groups and pumps. See './csv/eastside_assets.json' for example.
+    # The file is read and checked once, make() then hands out new,
+    # ready-to-query asset objects (pumps set) without reading any file.
+    classes = {
+        'pumpstation' : pumpstation,
+        'cso_basin' : cso_basin,
+        'sewer_meter' : sewer_meter,
+        'valve' : valve,
+    }
+    # attributes each class needs for its calculations
+    required = {
+        'pumpstation' : ['invert','depth_max','wet_wells'],
+        'cso_basin' : ['to_normalize','max_depth','invert'],
+        'sewer_meter' : ['depth_max','length'],
+        'valve' : [],
+    }
+    
+    def __str__(self):
+        return "Registry: {0} assets from {1}".format(len(self.config), self.filename)
+    
+    def __init__(self, filename, asset_fields):
+        self.filename = filename
+        self.asset_fields = asset_fields
+        
+        with open(filename) as f:
+            assets = json.load(f)['assets']
+        
+        errors = self.validate(assets)
+        if errors:
+            raise ValueError('{0}:\n'.format(filename) + '\n'.join(errors))
+        
+        self.config = OrderedDict()
+        for a in assets:
+            self.config[a['site']] = a
+        
+        # Indexes: site names by measure and by group
+        self.by_measure = {}
+        self.by_group = {}
+        for site,a in self.config.items():
+            self.by_measure.setdefault(a['measure'], []).append(site)
+            for g in a.get('groups', []):
+                self.by_group.setdefault(g, []).append(site)
+    
+    def validate(self, assets):
+        # Return a list of problems with the config, [] if none
+        errors = []
+        sites = [a['site'] for a in assets if 'site' in a]
+        for site in set(sites):
+            if sites.count(site) > 1:
+                errors.append('{0}: site declared {1} times'.format(site, sites.count(site)))
+        
+        for i,a in enumerate(assets):
+            # assets without a site are named by their position in the file
+            site = a.get('site', 'asset {0}'.format(i))
+            for key in ['site','measure','class']:
+                if key not in a:
+                    errors.append('{0}: no {1}'.format(site, key))
+            if a.get('class') not in registry.classes:
+                errors.append('{0}: unknown class {1}'.format(site, a.get('class')))
+            if a.get('measure') not in self.asset_fields:
+                errors.append('{0}: measure {1} not in the asset fields'.format(site, a.get('measure')))
+                continue
+            
+            fields = self.asset_fields[a['measure']]
+            for key,values in a.get('u_param', {}).items():
+                if not all(isinstance(v,(int,float)) for v in values):
+                    errors.append('{0}: u_param {1} is not numbers'.format(site, key))
+            for key in ['d_param','set_point']:
+                if key in a and not all(isinstance(v,(int,float)) for v in a[key]):
+                    errors.append('{0}: {1} is not numbers'.format(site, key))
+            if ('d_param' in a) != ('set_point' in a):
+                errors.append('{0}: d_param and set_point go together'.format(site))
+            for f in a.get('attributes', {}).get('to_normalize', []):
+                if f not in fields:
+                    errors.append('{0}: {1} not a field of {2}'.format(site, f, a['measure']))
+            
+            errors.extend(self.validate_attributes(a, site))
+            
+            if 'pumps' in a and a.get('class') != 'pumpstation':
+                errors.append('{0}: pumps on a {1}'.format(site, a.get('class')))
+            if 'pumps' not in a and a.get('class') == 'pumpstation':
+                errors.append('{0}: no pumps'.format(site))
+            for p in a.get('pumps', []):
+                if len(p) != 3 or not isinstance(p[1],(int,float)) or not isinstance(p[2],int):
+                    errors.append('{0}: pump {1} is not [name, flowrate, group]'.format(site, p))
+                elif p[0] not in fields:
+                    errors.append('{0}: pump {1} not a field of {2}'.format(site, p[0], a['measure']))
+        return errors
+    
+    def validate_attributes(self, a, site):
+        # Problems with the physical attributes and kwargs of one asset
+        errors = []
+        attributes = a.get('attributes', {})
+        if a.get('class') not in registry.required:
+            return errors
+        
+        for key in registry.required[a['class']]:
+            if key not in attributes:
+                errors.append('{0}: no attribute {1}'.format(site, key))
+        if any(key not in attributes for key in registry.required[a['class']]):
+            return errors
+        
+        def numbers(key, values):
+            if not isinstance(values, list) or not all(isinstance(v,(int,float)) for v in values):
+                errors.append('{0}: {1} is not a list of numbers'.format(site, key))
+                return False
+            return True
+        
+        if a['class'] == 'pumpstation':
+            ok = all([numbers(k, attributes[k]) for k in ['invert','depth_max','wet_wells']])
+            if ok and not attributes['wet_wells']:
+                errors.append('{0}: wet_wells is empty'.format(site))
+                ok = False
+            if ok and len(attributes['invert']) < attributes['wet_wells'][0]:
+                errors.append('{0}: invert for {1} wet wells'.format(site, attributes['wet_wells'][0]))
+            if ok and len(attributes['depth_max']) < attributes['wet_wells'][0]:
+                errors.append('{0}: depth_max for {1} wet wells'.format(site, attributes['wet_wells'][0]))
+        
+        elif a['class'] == 'cso_basin':
+            if numbers('max_depth', attributes['max_depth']) and numbers('invert', attributes['invert']):
+                n = len(attributes['to_normalize'])
+                if len(attributes['max_depth']) != n or len(attributes['invert']) != n:
+                    errors.append('{0}: to_normalize, max_depth and invert differ in length'.format(site))
+        
+        elif a['class'] == 'sewer_meter':
+            for key in ['depth_max','length']:
+                if not isinstance(attributes[key],(int,float)) or attributes[key] <= 0:
+                    errors.append('{0}: {1} is not a positive number'.format(site, key))
+            kwargs = a.get('kwargs', {})
+            if kwargs.get('shape', 'CIRCULAR') not in _fill_area:
+                errors.append('{0}: unknown shape {1}, expected one of {2}'.format(
+                    site, kwargs['shape'], ', '.join(sorted(_fill_area))))
+            if 'width' in kwargs and not isinstance(kwargs['width'],(int,float)):
+                errors.append('{0}: width is not a number'.format(site))
+        
+        return errors
+    
+    def make(self, *sites):
+        # List of new asset objects of the sites, in order.
+        return [self.make_one(site) for site in sites]
+    
+    def make_one(self, site):
+        # New asset object of a site
+        a = self.config[site]
+        obj = registry.classes[a['class']](site, a['measure'], self.asset_fields[a['measure']], **a.get('kwargs', {}))
+        
+        for key,value in a.get('attributes', {}).items():
+            setattr(obj, key, value)
+        if 'u_param' in a:
+            obj.u_param = {k: list(v) for k,v in a['u_param'].items()}
+        if 'd_param' in a:
+            obj.d_param = list(a['d_param'])
+            obj.set_point = list(a['set_point'])
+        obj.groups = list(a.get('groups', []))
+        if a['class'] == 'pumpstation':
+            obj.pump_dict(a['pumps'])
+        return obj
+    
+    def measure(self, measure):
+        # New objects of every site of a measure
+        return self.make(*self.by_measure.get(measure, []))
+    
+    def group(self, g):
+        # New objects of every site in market group g
+        return self.make(*self.by_group.get(g, []))
+
+
+class batch_writer():
+    # ---- About ----
+    # Collects line protocol lines during a cycle and writes them in
+    # batches of self.batch_size lines, one write_points call per batch.
+    # Has the same write_points() call as the influxDB client, so it can be
+    # handed to write_goals(), write_pump_recs() and write_rec() in its place.
+    # Lines that could not be written are returned by flush().
+    def __str__(self):
+        return "Batch writer: {0} lines queued".format(len(self.lines))
+    
+    def __init__(self, client, *args, **kwargs):
+        self.client = client
+        self.batch_size = 500
+        self.retries = 3
+        self.backoff = 1.0      # [sec] first wait, doubles every retry
+        
+        self.kwargs = kwargs
+        kw = self.kwargs.keys()
+        if 'batch_size' in kw:
+            self.batch_size = self.kwargs['batch_size']
+        if 'retries' in kw:
+            self.retries = self.kwargs['retries']
+        if 'backoff' in kw:
+            self.backoff = self.kwargs['backoff']
+        
+        self.lines = []
+        self.fails = []
+    
+    def write_points(self,points,protocol='line'):
+        # Queue lines. Write a batch as soon as one is full.
+        self.lines.extend(points)
+        while len(self.lines) >= self.batch_size:
+            batch = self.lines[:self.batch_size]
+            self.lines = self.lines[self.batch_size:]
+            self.fails.extend(self.write(batch))
+        return True
+    
+    def write(self,batch):
+        # Write one batch. Return a list of the lines that failed, [] if none
+        import influxdb
+        for attempt in range(self.retries + 1):
+            try:
+                self.client.write_points(batch,protocol='line')
+                return []
+            except influxdb.exceptions.InfluxDBClientError:
+                # Batch rejected by the database (eg. a malformed line).
+                # Retrying will not help; split it to find the bad lines.
+                if len(batch) == 1:
+                    return batch
+                half = len(batch) // 2
+                return self.write(batch[:half]) + self.write(batch[half:])
+            except Exception:
+                # Server error or lost connection, wait and try again.
+                if attempt < self.retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        return batch
+    
+    def flush(self):
+        # Write everything still queued.
+        # Return a list of lines that failed to write to influxDB, [] empty if none
+        for i in range(0,len(self.lines),self.batch_size):
+            self.fails.extend(self.write(self.lines[i:i+self.batch_size]))
+        self.lines = []
+        
+        fails = self.fails
+        self.fails = []
+        return fails
+    
+
+class spool():
+    # ---- About ----
+    # Append-only, gzip compressed file of line protocol lines that failed
+    # to write to influxDB. replay() writes them once the connection is
+    # back, so an outage does not leave gaps in the recommendation history.
+    # When the file grows past self.max_bytes it is rotated to
+    # filename.<epoch>; only the newest self.keep rotated files are kept.
+    def __str__(self):
+        return "Spool file at: " + self.filename
+    
+    def __init__(self, filename, *args, **kwargs):
+        self.filename = filename
+        self.max_bytes = 1000000
+        self.keep = 10
+        
+        self.kwargs = kwargs
+        kw = self.kwargs.keys()
+        if 'max_bytes' in kw:
+            self.max_bytes = self.kwargs['max_bytes']
+        if 'keep' in kw:
+            self.keep = self.kwargs['keep']
+    
+    def files(self):
+        # Rotated files, oldest first, then the active file. Other files
+        # next to it (eg. spool.gz.tmp, editor backups) are not spool files.
+        rotated = [fn for fn in glob.glob(self.filename + '.*') if re.fullmatch(r'\d+', fn.rsplit('.',1)[1])]
+        rotated.sort(key=lambda x: int(x.rsplit('.',1)[1]))
+        if os.path.exists(self.filename):
+            rotated.append(self.filename)
+        return rotated
+    
+    def append(self,lines):
+        if not lines:
+            return
+        
+        with gzip.open(self.filename,'at') as f:
+            for line in lines:
+                f.write(line + '\n')
+        
+        if os.path.getsize(self.filename) > self.max_bytes:
+            self.rotate()
+    
+    def rotate(self):
+        n = int(time.time())
+        while os.path.exists('{0}.{1}'.format(self.filename,n)):
+            n = n + 1
+        os.replace(self.filename,'{0}.{1}'.format(self.filename,n))
+        
+        rotated = self.files()
+        for old in rotated[:-self.keep]:
+            os.remove(old)
+    
+    def key(self,line):
+        # Lines for the same measurement, tags and timestamp are one point
+        # in influxDB, their field sets are merged (see read()).
+        return (line.split(' ',1)[0], line.rsplit(' ',1)[-1])
+    
+    def split_fields(self,line):
+        # Return the 'key=value' fields of a line, commas and spaces inside
+        # quoted string values kept.
+        field_set = line.split(' ',1)[1].rsplit(' ',1)[0]
+        fields = []
+        field = ''
+        quoted = False
+        escaped = False
+        for c in field_set:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == '"':
+                quoted = not quoted
+            elif c == ',' and not quoted:
+                fields.append(field)
+                field = ''
+                continue
+            field = field + c
+        fields.append(field)
+        return fields
+    
+    def read(self):
+        # Return all spooled lines, one per point (measurement, tags and
+        # timestamp), in the order spooled. Fields of the lines of a point
+        # are merged, the last spooled value of a field wins.
+        points = OrderedDict()
+        for fn in self.files():
+            with gzip.open(fn,'rt') as f:
+                for line in f:
+                    line = line.rstrip('\n')
+                    if line:
+                        key = self.key(line)
+                        fields = points.pop(key,OrderedDict())
+                        for field in self.split_fields(line):
+                            fields[field.split('=',1)[0]] = field
+                        points[key] = fields
+        
+        return ['{0} {1} {2}'.format(key[0], ','.join(fields.values()), key[1]) for key,fields in points.items()]
+    
+    def clear(self):
+        for fn in self.files():
+            os.remove(fn)
+    
+    def replay(self,client,**kwargs):
+        # Write spooled lines in batches (see batch_writer, kwargs passed on).
+        # Lines that still fail go back in the spool and are returned.
+        lines = self.read()
+        if not lines:
+            return []
+        
+        writer = batch_writer(client,**kwargs)
+        writer.write_points(lines)
+        fails = writer.flush()
+        
+        self.clear()
+        self.append(fails)
+        return fails
+    
+
+class snapshot():
+    # ---- About ----
+    # Per-cycle cache of the last measures of a set of assets. The first
+    # script of a cycle queries every asset in one multi-statement request
+    # and saves the result to a small json file. Later scripts in the same
+    # cycle hydrate their asset objects from the file instead of querying
+    # InfluxDB again. Assets missing from the file are queried and added.
+    def __str__(self):
+        return "Snapshot cache at: " + self.filename
+    
+    def __init__(self, filename, *args, **kwargs):
+        self.filename = filename
+        self.cycle = 600        # [sec] length of a recommendation cycle
+        self.ttl = 300          # [sec] max age of a snapshot before requery
+        self.chunk_size = 50    # statements per request
+        
+        self.kwargs = kwargs
+        kw = self.kwargs.keys()
+        if 'cycle' in kw:
+            self.cycle = self.kwargs['cycle']
+        if 'ttl' in kw:
+            self.ttl = self.kwargs['ttl']
+        if 'chunk_size' in kw:
+            self.chunk_size = self.kwargs['chunk_size']
+        
+        self.assets = {}
+        # stages running at the same time share one snapshot query
+        self.lock = threading.Lock()
+    
+    def key(self,a):
+        return '{0},{1}'.format(a.measure,a.name)
+    
+    def cycle_time(self):
+        # Start of the current cycle, seconds since epoch.
+        now = time.time()
+        return int(now // self.cycle) * self.cycle
+    
+    def load(self):
+        # Read the cache file. Stale or missing snapshots load as empty.
+        self.assets = {}
+        try:
+            with open(self.filename) as f:
+                cached = json.load(f)
+        except (IOError, ValueError):
+            return self.assets
+        
+        fresh = time.time() - cached['created'] < self.ttl
+        if cached['cycle'] == self.cycle_time() and fresh:
+            self.assets = cached['assets']
+        return self.assets
+    
+    def save(self):
+        cached = {
+            'cycle' : self.cycle_time(),
+            'created' : time.time(),
+            'assets' : self.assets
+        }
+        # write then rename, other scripts never see a partial file
+        tmp = self.filename + '.tmp'
+        with open(tmp,'w') as f:
+            json.dump(cached,f)
+        os.replace(tmp,self.filename)
+    
+    def query(self,client,assets):
+        # Query the last value of every field of every asset with
+        # multi-statement requests of self.chunk_size statements.
+        statements = []
+        for a in assets:
+            a.empty_fields = []
+            statements.extend([(a,f) for f in a.fields])
+        
+        for i in range(0,len(statements),self.chunk_size):
+            chunk = statements[i:i+self.chunk_size]
+            query_str = ';'.join([a.query_statement(f) for a,f in chunk])
+            query_return = client.query(query_str)
+            
+            for (a,f),result in zip(chunk,split_results(query_return)):
+                a.store_last(f,result)
+        
+        for a in assets:
+            self.assets[self.key(a)] = dict(a.fields)
+    
+    def hydrate(self,client,assets):
+        # Fill asset.fields from the cached snapshot. Query and cache
+        # the assets the snapshot does not have yet.
+        with self.lock:
+            self.load()
+            
+            missing = [a for a in assets if self.key(a) not in self.assets]
+            if missing:
+                self.query(client,missing)
+                self.save()
+            
+            for a in assets:
+                a.empty_fields = []
+                cached = self.assets[self.key(a)]
+                for f in a.fields:
+                    # copy, normalized_depth() appends to the [time, value] list
+                    if cached.get(f):
+                        a.fields[f] = list(cached[f])
+                    else:
+                        a.fields[f] = ''
+                        a.empty_fields.append(f)
+        
+        return missing
+        
+    
 class report():
     # Class to push reporting and warnings to a txt file.
     # Use in conjuction with a pipe during the cron to
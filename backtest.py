@@ -0,0 +1,134 @@
+# Description:  Historical replay of the MBC recommendations. Pulls the history of
+#               the CombinedMBC.py assets from InfluxDB one time window at a time
+#               and runs the same recommendation logic (CombinedMBC.recommend) at
+#               every 10 minute step, as if the script had run then.
+#               Nothing is written to InfluxDB.
+#
+# Usage:        python backtest.py "2019-05-11 00:00" "2019-05-14 00:00" recs.csv
+#               Times in UTC. One csv row per upstream goal and per pump per step.
+
+import csv
+import datetime as dt
+import sys
+
+import SystemAssets as SA
+import CombinedMBC
+
+t_format = '%Y-%m-%dT%H:%M:%SZ'
+
+# Fields CombinedMBC.recommend reads, per asset of CombinedMBC.make_assets()
+mbc_fields = [
+    ['WET_WELL_1','WET_WELL_2'],        # con
+    ['WET_WELL_1'],                     # fre
+    ['WET_WELL_1','STATION_FLOWRATE'],  # fvw
+    ['BASIN_LEVEL','FOREBAY_LEVEL'],    # CC_BF
+    ['LEVEL','FLOW'],                   # DRI
+]
+
+def missing_fields(assets):
+    # (asset, field) pairs the MBC needs that have no data yet
+    missing = []
+    for a, fields in zip(assets, mbc_fields):
+        for f in fields:
+            if not a.fields.get(f) or a.fields[f][1] is None:
+                missing.append((a.name, f))
+    return missing
+
+def history_statement(a, t0, t1, step):
+    # Last value of every field of asset a in each step long bucket of [t0, t1)
+    fields = ','.join(['last({0}) AS {0}'.format(f) for f in a.fields])
+    return "SELECT {0} FROM {1} WHERE SITE='{2}' AND time >= '{3}' AND time < '{4}' GROUP BY time({5}s) fill(null)".format(
+        fields, a.measure, a.name, t0.strftime(t_format), t1.strftime(t_format), step)
+
+def stream_states(client, assets, start, end, step=600, window=86400):
+    # ---- About ----
+    # Generator of the step times in [start, end). Before each yield the
+    # assets' fields are set to the last value seen up to that step, as
+    # [time, value] with the step time, like query_measures() would have.
+    # Queries window seconds of history at a time (one multi-statement
+    # request for all assets), so memory does not grow with the range.
+    epoch0 = dt.datetime(1970,1,1)
+    start = epoch0 + dt.timedelta(seconds = (start - epoch0).total_seconds() // step * step)
+    window = dt.timedelta(seconds = max(window // step, 1) * step)
+    step_td = dt.timedelta(seconds = step)
+
+    # last value of each field, carried across buckets and windows
+    last = [{} for a in assets]
+
+    t0 = start
+    while t0 < end:
+        t1 = min(t0 + window, end)
+        query_str = ';'.join([history_statement(a, t0, t1, step) for a in assets])
+        results = SA.split_results(client.query(query_str))
+
+        # {bucket time string: row} for each asset
+        buckets = []
+        for result in results:
+            rows = {}
+            for series in result.raw.get('series', []):
+                columns = series['columns']
+                for values in series['values']:
+                    rows[values[0]] = dict(zip(columns[1:], values[1:]))
+            buckets.append(rows)
+
+        b = t0
+        while b < t1:
+            # Recommendation made at the end of the bucket
+            t = b + step_td
+            t_str = t.strftime(t_format)
+            for a, rows, seen in zip(assets, buckets, last):
+                row = rows.get(b.strftime(t_format), {})
+                for f in a.fields:
+                    if row.get(f) is not None:
+                        seen[f] = row[f]
+                    a.fields[f] = [t_str, seen[f]] if f in seen else ''
+            yield t
+            b = t
+
+        t0 = t1
+
+def replay(client, asset_fields, start, end, step=600, window=86400, skipped=None):
+    # ---- About ----
+    # Generator of (step time, [con, fre, fvw, CC_BF]) with q_goal, v_goal and
+    # pump recommendations set as CombinedMBC.py would have at that time.
+    # Steps without data for every field in mbc_fields yet are skipped, and
+    # (step time, missing fields) appended to the skipped list if given.
+    con, fre, fvw, CC_BF, DRI = CombinedMBC.make_assets(asset_fields)
+    assets = [con, fre, fvw, CC_BF, DRI]
+
+    for t in stream_states(client, assets, start, end, step, window):
+        missing = missing_fields(assets)
+        if missing:
+            if skipped is not None:
+                skipped.append((t, missing))
+            continue
+        CombinedMBC.recommend(con, fre, fvw, CC_BF, DRI)
+        yield t, [con, fre, fvw, CC_BF]
+
+def write_csv(fn, recs):
+    with open(fn, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['time', 'site', 'key', 'group', 'flow_rec', 'volume_rec', 'rec_seconds', 'rec_bool'])
+        for t, upstream in recs:
+            t_str = t.strftime('%Y-%m-%d %H:%M:%S')
+            for a in upstream:
+                for key in a.q_goal:
+                    w.writerow([t_str, a.name, key, a.q_goal[key][2], a.q_goal[key][1], a.v_goal[key][1], '', ''])
+            for ps in upstream[:3]:
+                for p in ps.pumps:
+                    if isinstance(ps.pumps[p].rec, dict):
+                        rec = ps.pumps[p].rec
+                        w.writerow([t_str, ps.name, p, ps.pumps[p].group, '', '', rec['REC_SECONDS'], rec['REC_BOOL']])
+
+if __name__ == '__main__':
+    start = dt.datetime.strptime(sys.argv[1], '%Y-%m-%d %H:%M')
+    end = dt.datetime.strptime(sys.argv[2], '%Y-%m-%d %H:%M')
+
+    influx_client = SA.connection(CombinedMBC.connect_file)
+    asset_fields = SA.get_asset_fields(CombinedMBC.fields_file)
+
+    skipped = []
+    write_csv(sys.argv[3], replay(influx_client, asset_fields, start, end, skipped=skipped))
+    if skipped:
+        print('{0} steps skipped, from {1} to {2}: no data yet for {3}'.format(
+            len(skipped), skipped[0][0], skipped[-1][0], skipped[-1][1]))
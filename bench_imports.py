@@ -0,0 +1,97 @@
+# Description:  Startup benchmark. Imports each module in a fresh python process
+#               with '-X importtime', records the cumulative import time and the
+#               heavy dependencies it pulled in, and appends the results to a csv
+#               file so regressions show up between runs.
+#
+# Usage:        python bench_imports.py [records.csv]
+#               Exits 1 if a module loads a dependency it should not, or is
+#               much slower than its last recorded run.
+
+import csv
+import os
+import subprocess
+import sys
+import time
+
+# module: heavy dependencies it must *not* load at import
+modules = {
+    'SystemAssets': ['influxdb', 'pytz'],
+    'swmmAPI_v2': ['pandas', 'pyswmm', 'influxdb', 'pytz'],
+    'build_full_svg': ['influxdb', 'boto3'],
+    'latest': ['influxdb', 'boto3'],
+    'recommended': ['influxdb', 'boto3'],
+    'CombinedMBC': ['svgutils', 'boto3'],
+    'stages': [],
+}
+heavy = ['numpy', 'pandas', 'pyswmm', 'influxdb', 'pytz', 'svgutils', 'boto3']
+
+# slower than last run by both of these is a regression
+slower_ratio = 1.25
+slower_ms = 5.0
+
+def import_time(module):
+    # Return (cumulative import time [ms], heavy modules loaded)
+    code = "import sys, {0}; print(','.join(m for m in {1!r} if m in sys.modules))".format(module, heavy)
+    run = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if run.returncode:
+        raise RuntimeError(run.stderr.strip().split('\n')[-1])
+
+    # 'import time: self [us] | cumulative | imported package'
+    ms = None
+    for l in run.stderr.split('\n'):
+        a = l.split('|')
+        if len(a) == 3 and a[2].strip() == module:
+            ms = int(a[1]) / 1000.0
+    loaded = [m for m in run.stdout.strip().split(',') if m]
+    return ms, loaded
+
+def last_records(fn):
+    last = {}
+    if os.path.exists(fn):
+        with open(fn) as f:
+            for row in csv.DictReader(f):
+                last[row['module']] = float(row['ms'])
+    return last
+
+def main(fn):
+    last = last_records(fn)
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    problems = []
+    rows = []
+
+    for module, forbidden in modules.items():
+        try:
+            ms, loaded = import_time(module)
+        except RuntimeError as e:
+            print('{0:<16} could not import: {1}'.format(module, e))
+            problems.append('{0} could not import: {1}'.format(module, e))
+            continue
+
+        print('{0:<16} {1:>9.1f} ms   {2}'.format(module, ms, ' '.join(loaded)))
+        rows.append([stamp, module, '{0:.1f}'.format(ms), ' '.join(loaded)])
+
+        for m in loaded:
+            if m in forbidden:
+                problems.append('{0} loads {1} at import'.format(module, m))
+        if module in last:
+            if ms > last[module] * slower_ratio and ms - last[module] > slower_ms:
+                problems.append('{0} import {1:.1f} ms, was {2:.1f} ms'.format(module, ms, last[module]))
+
+    new = not os.path.exists(fn)
+    with open(fn, 'a', newline='') as f:
+        w = csv.writer(f)
+        if new:
+            w.writerow(['time', 'module', 'ms', 'loaded'])
+        w.writerows(rows)
+
+    for p in problems:
+        print('REGRESSION: ' + p)
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    fn = 'import_times.csv'
+    if len(sys.argv) > 1:
+        fn = sys.argv[1]
+    sys.exit(main(fn))
@@ -9,21 +9,31 @@ import svgutils.transform as sg
 import subprocess
 import datetime as dt
 
-## DIFFERENT SCRIPT IN FINAL
-final = sg.SVGFigure("19in","11.5in")
 
-base = sg.fromfile('GRAPHICS/base_v2.svg')
-base = base.getroot()
+def build_full_svg(latest=None, recs=None):
+	# latest, recs: SVGFigures from latest.latest() and recommended.recommended().
+	# Read from GRAPHICS/ when not given.
+	## DIFFERENT SCRIPT IN FINAL
+	final = sg.SVGFigure("19in","11.5in")
 
-latest = sg.fromfile('GRAPHICS/latest.svg')
-latest = latest.getroot()
+	base = sg.fromfile('GRAPHICS/base_v2.svg')
+	base = base.getroot()
 
-recs = sg.fromfile('GRAPHICS/recommended.svg')
-recs = recs.getroot()
+	if latest is None:
+		latest = sg.fromfile('GRAPHICS/latest.svg')
+	latest = latest.getroot()
 
-t_str = "Dash Build Time: " + dt.datetime.utcnow().strftime("%m-%d %H:%M") + " UTC"
-build_time = sg.TextElement(25,60,t_str,size=12,color='red')
+	if recs is None:
+		recs = sg.fromfile('GRAPHICS/recommended.svg')
+	recs = recs.getroot()
 
-final.append([base,latest,recs,build_time])
-final.set_size(["1900px","1150px"])
-final.save('GRAPHICS/base_latest_recommended.svg')
\ No newline at end of file
+	t_str = "Dash Build Time: " + dt.datetime.utcnow().strftime("%m-%d %H:%M") + " UTC"
+	build_time = sg.TextElement(25,60,t_str,size=12,color='red')
+
+	final.append([base,latest,recs,build_time])
+	final.set_size(["1900px","1150px"])
+	final.save('GRAPHICS/base_latest_recommended.svg')
+
+
+if __name__ == '__main__':
+	build_full_svg()
@@ -0,0 +1,299 @@
+# Description:  Genetic algorithm search for Water Exchange Market parameters
+#               (see docs/DeterminingParameters.rst). Each individual is a set of
+#               u_params (one per ControlPoint) and epsilons and set points (one
+#               per DownstreamPoint). Individuals are scored by running the pyswmm
+#               simulation with market based control. The individuals of a
+#               generation are simulated in parallel on a process pool.
+#
+#               Every worker parses the .inp file and the control/downstream point
+#               csv files once, when it starts, and reuses them for every
+#               simulation. Results come back as push_meta() style records and are
+#               appended to a metadata csv file.
+#
+#               With a results_dir, results are also kept per configuration (hash of
+#               the .inp, the point csv files, the parameters and simulation options),
+#               so elites and repeated individuals are never simulated twice.
+#
+# Usage:        python genetic_search.py model.inp control_points.csv downstream_points.csv meta.csv
+
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+import swmmAPI_v2 as swmm
+import market
+
+# Set in each worker by init_worker()
+_worker = {}
+
+def param_count(control_points, downstream_points):
+    return len(control_points) + 2 * len(downstream_points)
+
+def set_params(control_points, downstream_points, individual):
+    # individual = [u_param of each cp, epsilon of each dp, set_point of each dp]
+    n_c = len(control_points)
+    n_d = len(downstream_points)
+    for c,u in zip(control_points, individual[:n_c]):
+        c.u_param = float(u)
+    for d,e,s in zip(downstream_points, individual[n_c:n_c+n_d], individual[n_c+n_d:]):
+        d.epsilon = float(e)
+        d.set_point = float(s)
+
+def simulate(inp_file, model, control_points, downstream_points, name, *args, **kwargs):
+    # ---- About ----
+    # Run one pyswmm simulation with market based control.
+    # Groups are numbered from 1 with one DownstreamPoint each.
+    # kwargs:
+    #   outfile: SWMM .out file (default next to the .inp, as pyswmm does)
+    #   wrrf: outfalls that are not CSOs, not counted in the CSO volume
+    #   flood_weight: weight of a flooded control step in the fitness
+    #   offset: datum offset, passed to swmmAPI_v2.system
+    #   control_step: seconds between market/control decisions, default
+    #                 the routing step (see swmmAPI_v2.run_schedule)
+    #   report_step: seconds between samples of the CSO outfall flows,
+    #                default control_step
+    #   cache_dir: parsed model cache of the workers, see swmmINP.save_cache
+    #   recs_dir: if given, the control points' actions, depths, flooding and
+    #             q_goals at each report step are saved to recs_dir/<name>.npz
+    # Return push_meta() record prefixed with the fitness and CSO volume:
+    # 'fitness,cso_volume,flood_count,name,Group1,...'. Lower fitness is better.
+    outfile = kwargs.get('outfile')
+    wrrf = kwargs.get('wrrf', [])
+    flood_weight = kwargs.get('flood_weight', 1.0)
+
+    for c in control_points:
+        c.flood_count = 0.0
+
+    dps = sorted(downstream_points, key=lambda d: d.group)
+    cso_outfalls = [o for o in model.outfalls if o not in wrrf]
+    routing_step = model.options['ROUTING_STEP']
+    control_step = kwargs.get('control_step', routing_step)
+
+    mkt = market.market(
+        [c.group - 1 for c in control_points],
+        [c.u_param for c in control_points],
+        [d.epsilon for d in dps],
+        [d.set_point for d in dps],
+        recommendation_time = control_step
+    )
+    no_q_out = np.zeros(len(dps))
+
+    cso_volume = [0.0]
+    with swmm.Simulation(inp_file, outputfile=outfile) as sim:
+        run = swmm.system(sim, offset=kwargs.get('offset', 0.0), control_step=control_step)
+        run.groups = len(dps)
+
+        nodes = swmm.pyswmm.Nodes(sim)
+        links = swmm.pyswmm.Links(sim)
+        for c in control_points:
+            c.set_vars(nodes, links)
+            c.get_model_info(model)
+        for d in dps:
+            d.set_vars(nodes, links)
+            d.get_model_info(model)
+        outfall_nodes = [nodes[o] for o in cso_outfalls]
+        bank = swmm.ControlBank(control_points, nodes)
+        recs = swmm.Recorder(control_points)
+
+        def control(t):
+            for c in control_points:
+                c.get_measure()
+            for d in dps:
+                d.get_measure()
+
+            d_down = np.array([d.now / d.max_depth for d in dps])
+            v_avail = (1.0 - d_down) * np.array([d.max_vol for d in dps])
+            goals = mkt.solve(
+                [c.now / c.max_depth for c in control_points],
+                d_down,
+                v_avail,
+                no_q_out
+            )
+            bank.step(run, goals['q_goal'])
+
+        def report(t, dt):
+            cso_volume[0] = cso_volume[0] + sum([o.total_inflow for o in outfall_nodes]) * dt
+            if 'recs_dir' in kwargs:
+                recs.record(t)
+
+        swmm.run_schedule(sim, run, control, report, report_step=kwargs.get('report_step', control_step))
+
+    cso_volume = cso_volume[0]
+    if 'recs_dir' in kwargs:
+        recs.save(os.path.join(kwargs['recs_dir'], name + '.npz'))
+    run.flood_count = sum([c.flood_count for c in control_points])
+    fitness = cso_volume + flood_weight * run.flood_count
+
+    meta = swmm.push_meta(run, name, control_points, dps, False)
+    return '{0},{1},{2}'.format(fitness, cso_volume, meta)
+
+# simulate() kwargs that do not change the result
+_not_in_key = ['outfile', 'cache_dir', 'recs_dir', 'results_dir']
+
+def files_hash(*fns):
+    h = hashlib.sha256()
+    for fn in fns:
+        with open(fn, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+def result_key(files, control_points, downstream_points, kwargs):
+    # Hash of the model files, the exact parameters of every point and the
+    # simulation options. Same key, same simulation.
+    params = (
+        [(c.c_name, c.u_param, c.ds_param) for c in control_points],
+        [(d.d_name, d.epsilon, d.set_point, d.gamma, d.set_derivative) for d in downstream_points],
+        sorted([(k, repr(v)) for k,v in kwargs.items() if k not in _not_in_key]),
+    )
+    return hashlib.sha256((files + repr(params)).encode()).hexdigest()
+
+def load_result(results_dir, key, name):
+    # simulate() record of a cached result, with this run's name. None if not cached.
+    try:
+        with open(os.path.join(results_dir, key + '.json')) as f:
+            result = json.load(f)
+    except (IOError, ValueError):
+        return None
+    # push_meta: 'flood_count,name,Group1,...'
+    flood_count, old_name, rest = result['meta'].split(',', 2)
+    meta = ','.join([flood_count, name, rest])
+    return '{0},{1},{2}'.format(result['fitness'], result['cso_volume'], meta)
+
+def save_result(results_dir, key, record):
+    fitness, cso_volume, meta = record.split(',', 2)
+    result = {
+        'fitness': float(fitness),
+        'cso_volume': float(cso_volume),
+        'flood_count': float(meta.split(',', 1)[0]),
+        'meta': meta,
+    }
+    # written whole, other workers never read a partial file
+    fn = os.path.join(results_dir, key + '.json')
+    tmp = fn + '.{0}.tmp'.format(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(result, f)
+    os.replace(tmp, fn)
+
+def init_worker(inp_file, cp_file, dp_file, kwargs):
+    # Parse the model and points once per worker process.
+    # Sections are parsed on first use (in the first simulation) and kept.
+    # With a cache_dir kwarg, workers share one parsed model cache, see
+    # evaluate() for the dictionaries built by the first simulation.
+    model = swmm.swmmINP(inp_file, cache_dir=kwargs.get('cache_dir'))
+
+    _worker['inp_file'] = inp_file
+    _worker['model'] = model
+    _worker['control_points'] = swmm.make_control_points(cp_file)
+    _worker['downstream_points'] = swmm.make_downstream_points(dp_file)
+    _worker['kwargs'] = dict(kwargs)
+    if 'results_dir' in kwargs:
+        _worker['files'] = files_hash(inp_file, cp_file, dp_file)
+    # own .out file, workers must not write over each other's
+    _worker['kwargs']['outfile'] = os.path.join(tempfile.gettempdir(), 'ga_worker_{0}.out'.format(os.getpid()))
+
+def evaluate(job):
+    # Worker side. job = (name, individual). Return the simulate() record.
+    name, individual = job
+    kwargs = _worker['kwargs']
+    set_params(_worker['control_points'], _worker['downstream_points'], individual)
+
+    if 'results_dir' in kwargs:
+        key = result_key(_worker['files'], _worker['control_points'], _worker['downstream_points'], kwargs)
+        record = load_result(kwargs['results_dir'], key, name)
+        if record is not None:
+            return record
+
+    record = simulate(
+        _worker['inp_file'],
+        _worker['model'],
+        _worker['control_points'],
+        _worker['downstream_points'],
+        name,
+        **kwargs
+    )
+
+    if 'results_dir' in kwargs:
+        save_result(kwargs['results_dir'], key, record)
+    if 'cache_dir' in kwargs and not _worker.get('cached'):
+        # the dictionaries the simulation needed are built now, keep them
+        _worker['model'].save_cache()
+        _worker['cached'] = True
+    return record
+
+def next_generation(pop, fitness, rng, elite=2, mutation=0.1, tournament=3):
+    # Elitism, tournament selection, uniform crossover and gaussian mutation.
+    # Parameters stay in [0, 1].
+    order = np.argsort(fitness)
+    children = [pop[i] for i in order[:elite]]
+
+    def select():
+        picks = rng.randint(0, len(pop), tournament)
+        return pop[picks[np.argmin(fitness[picks])]]
+
+    while len(children) < len(pop):
+        a, b = select(), select()
+        mask = rng.rand(len(a)) < 0.5
+        child = np.where(mask, a, b)
+        mutate = rng.rand(len(child)) < mutation
+        child = child + mutate * rng.normal(0.0, 0.1, len(child))
+        children.append(np.clip(child, 0.0, 1.0))
+
+    return np.array(children)
+
+def run_ga(inp_file, cp_file, dp_file, meta_file, *args, **kwargs):
+    # ---- About ----
+    # kwargs:
+    #   generations, pop_size, processes (default: all cores), seed,
+    #   elite, mutation, results_dir (cache of simulation results).
+    #   Others are passed on to simulate().
+    # Every record is appended to meta_file as it comes in.
+    # Return (best individual, best fitness).
+    generations = kwargs.pop('generations', 20)
+    pop_size = kwargs.pop('pop_size', 40)
+    processes = kwargs.pop('processes', None)
+    rng = np.random.RandomState(kwargs.pop('seed', None))
+    elite = kwargs.pop('elite', 2)
+    mutation = kwargs.pop('mutation', 0.1)
+
+    n = param_count(swmm.make_control_points(cp_file), swmm.make_downstream_points(dp_file))
+    pop = rng.rand(pop_size, n)
+
+    if 'results_dir' in kwargs:
+        os.makedirs(kwargs['results_dir'], exist_ok=True)
+
+    best, best_fitness = None, math.inf
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(inp_file, cp_file, dp_file, kwargs))
+    try:
+        for g in range(generations):
+            jobs = [('gen{0}_ind{1}'.format(g, i), ind) for i,ind in enumerate(pop)]
+            fitness = np.zeros(len(pop))
+
+            with open(meta_file, 'a') as f:
+                # chunksize 1: simulations are long and of uneven length
+                for i,record in enumerate(pool.imap(evaluate, jobs, chunksize=1)):
+                    f.write(record + '\n')
+                    f.flush()
+                    fitness[i] = float(record.split(',')[0])
+
+            i = np.argmin(fitness)
+            if fitness[i] < best_fitness:
+                best, best_fitness = pop[i].copy(), fitness[i]
+            print('Generation {0}: best {1}'.format(g, best_fitness))
+
+            pop = next_generation(pop, fitness, rng, elite, mutation)
+    finally:
+        pool.close()
+        pool.join()
+
+    return best, best_fitness
+
+if __name__ == '__main__':
+    best, best_fitness = run_ga(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
+    print(best_fitness, ','.join(map(str, best)))
@@ -9,57 +9,71 @@ import SystemAssets as SA
 import svgutils.transform as sg
 import datetime as dt
 
-# Establish InfluxDB Connection
-influx_client = SA.connection('PATH/TO/Influx_Connect_File.csv')
-# Bring in Fields To Query
-asset_fields = SA.get_asset_fields('PATH/TO/GLWA_infdb_data_structures.csv')
 
+def latest(influx_client, asset_fields, snapshot, assets=None):
+    # Build the latest pump/gate layer. Return the SVGFigure.
+    # assets: SA.registry with the stations, pumps already set.
+    
+    if assets is not None:
+        con, fre, fvw = assets.make('CON','FRE','FVW')
+    else:
+        # Pumpstation class needs: site_name, measure, query_fields
+        fvw = SA.pumpstation('FVW','FAIRVIEW',asset_fields['FAIRVIEW'])
+        con = SA.pumpstation('CON','CONNER',asset_fields['CONNER'])
+        fre = SA.pumpstation('FRE','FREUD',asset_fields['FREUD'])
+        for ps in [con,fre,fvw]:
+            ps.pump_dict()
 
-# Pumpstation class needs: site_name, measure, query_fields
-fvw = SA.pumpstation('FVW','FAIRVIEW',asset_fields['FAIRVIEW'])
-con = SA.pumpstation('CON','CONNER',asset_fields['CONNER'])
-fre = SA.pumpstation('FRE','FREUD',asset_fields['FREUD'])
+    # query measurements for each station
+    snapshot.hydrate(influx_client, [con,fre,fvw])
 
+    add_to_base = []
+    for name in [con,fre,fvw]:
+        # Count which pumps are on for each station
+        name.pumps_running()
 
-add_to_base = []
-for name in [con,fre,fvw]:
-    # query measurements for each station
-    name.query_measures(influx_client)
-    name.pump_dict()
+        # Count the gate states for Conner Forebay
+        if name.measure == 'CONNER':
+            name.gates_open('SWR_GATE_',9)
+            name.running['SG'] = name.open_gates
+        
+        # Add the .svg filename that corresponds to the proper 
+        # number of pumps/gates ON for each pumpstation to the 
+        # add_to_base list
+        for key in name.running:        
+            if name.running[key] > 0:
+                fstr = 'GRAPHICS/{0}/CURRENT/{1}/{2}.svg'.format(name.measure,key,name.running[key])
+                add_to_base.append(fstr)
+                
 
-    # Count which pumps are on for each station
-    name.pumps_running()
+    # Build "LATEST.SVG" Figure
+    build = sg.SVGFigure("19in","11.5in")
 
-    # Count the gate states for Conner Forebay
-    if name.measure == 'CONNER':
-        name.gates_open('SWR_GATE_',9)
-        name.running['SG'] = name.open_gates
-    
-    # Add the .svg filename that corresponds to the proper 
-    # number of pumps/gates ON for each pumpstation to the 
-    # add_to_base list
-    for key in name.running:        
-        if name.running[key] > 0:
-            fstr = 'PATH/TO/GRAPHICS/{0}/CURRENT/{1}/{2}.svg'.format(name.measure,key,name.running[key])
-            add_to_base.append(fstr)
-            
+    svg_list = []
+    # svg_list.append(base)
 
-# Build "LATEST.SVG" Figure
-build = sg.SVGFigure("19in","11.5in")
+    for fstr in add_to_base:
+        layer = sg.fromfile(fstr)
+        layer = layer.getroot()
+        # layer.moveto(5,280)
+        svg_list.append(layer)
+        
+    t_str = "Pump Build Time: " + dt.datetime.utcnow().strftime("%m-%d %H:%M") + " UTC"
+    build_time = sg.TextElement(25,20,t_str,size=12,color='red')
+    svg_list.append(build_time)
+        
+    # Make Latest Pump Layer 
+    build.append(svg_list)
+    return build
 
-svg_list = []
-# svg_list.append(base)
 
-for fstr in add_to_base:
-    layer = sg.fromfile(fstr)
-    layer = layer.getroot()
-    # layer.moveto(5,280)
-    svg_list.append(layer)
-    
-t_str = "Pump Build Time: " + dt.datetime.utcnow().strftime("%m-%d %H:%M") + " UTC"
-build_time = sg.TextElement(25,20,t_str,size=12,color='red')
-svg_list.append(build_time)
-    
-# Make Latest Pump Layer 
-build.append(svg_list)
-build.save('PATH/TO/GRAPHICS/latest.svg')
\ No newline at end of file
+if __name__ == '__main__':
+    # Establish InfluxDB Connection
+    influx_client = SA.connection('PATH/TO/Influx_Connect_File.csv')
+    # Bring in Fields To Query
+    asset_fields = SA.get_asset_fields('PATH/TO/GLWA_infdb_data_structures.csv')
+    # Snapshot of latest measures, normally already made by CombinedMBC.py this cycle
+    snapshot = SA.snapshot('PATH/TO/snapshot.json')
+
+    build = latest(influx_client, asset_fields, snapshot)
+    build.save('PATH/TO/GRAPHICS/latest.svg')
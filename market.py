@@ -0,0 +1,140 @@
+# Description:  Water Exchange Market engine. Computes the market (purchasing
+#               power, Pareto price, available flow and the flow/volume goals)
+#               for any number of groups in one vectorized pass.
+#
+#               A group is a set of upstream agents that sell water to one
+#               downstream point. The topology is given as flat arrays:
+#               upstream agent i is in group up_group[i] and has weight u_param[i];
+#               downstream point g of group g has weight d_param[g] and set_point[g].
+#               Sums over the agents of a group are done with np.bincount, or
+#               an agent x group incidence matrix for batches (see solve_batch).
+#
+#               See docs/WaterExchangeMarket.rst for the theory and CombinedMBC.py
+#               for the Eastside configuration.
+
+import numpy as np
+
+
+class market():
+    # ---- About ----
+    # Group topology and market parameters. solve() takes the current states
+    # and returns the market quantities as arrays.
+    #
+    # kwargs:
+    #   recommendation_time [sec], default 600
+    #   d_clamp: per group, True clamps negative downstream depths to 0.0
+    #            before the downstream cost (eg. CSO basins), default False
+    #   v_from_q: per group, True makes v_goal = q_goal * recommendation_time,
+    #             False (default) makes v_goal = v_avail * Ppower
+    def __str__(self):
+        return "Market: {0} agents in {1} groups".format(len(self.up_group), self.n_groups)
+
+    def __init__(self, up_group, u_param, d_param, set_point, *args, **kwargs):
+        self.up_group = np.asarray(up_group, dtype=int)
+        self.u_param = np.asarray(u_param, dtype=float)
+        self.d_param = np.asarray(d_param, dtype=float)
+        self.set_point = np.asarray(set_point, dtype=float)
+        self.n_groups = len(self.d_param)
+
+        self.recommendation_time = 600.0
+        self.d_clamp = np.zeros(self.n_groups, dtype=bool)
+        self.v_from_q = np.zeros(self.n_groups, dtype=bool)
+
+        self.kwargs = kwargs
+        kw = self.kwargs.keys()
+        if 'recommendation_time' in kw:
+            self.recommendation_time = float(self.kwargs['recommendation_time'])
+        if 'd_clamp' in kw:
+            self.d_clamp = np.asarray(self.kwargs['d_clamp'], dtype=bool)
+        if 'v_from_q' in kw:
+            self.v_from_q = np.asarray(self.kwargs['v_from_q'], dtype=bool)
+
+        # Number of "tanks" in a group: its upstream agents and the downstream point
+        self.tanks = np.bincount(self.up_group, minlength=self.n_groups) + 1
+        # incidence[i, g] = 1 if agent i is in group g, for batched group sums
+        self.incidence = np.zeros((len(self.up_group), self.n_groups))
+        self.incidence[np.arange(len(self.up_group)), self.up_group] = 1.0
+
+    def group_sum(self, x):
+        # Sum a per-agent array over the agents of each group (last axis).
+        if x.ndim == 1:
+            return np.bincount(self.up_group, weights=x, minlength=self.n_groups)
+        # batches: (..., n_agents) @ (n_agents, n_groups) incidence matrix
+        return x @ self.incidence
+
+    def solve(self, d_up, d_down, v_avail, q_out):
+        # ---- About ----
+        # d_up: normalized depth of each upstream agent
+        # d_down: normalized depth of each group's downstream point
+        # v_avail: volume available downstream of each group
+        # q_out: known outflow of each group's downstream point, 0.0 if unknown
+        # Return dict of arrays. Per agent: PW, Ppower, q_goal, v_goal.
+        # Per group: Pwealth, dcost, Pareto, Qavail.
+        return self.evaluate(d_up, d_down, v_avail, q_out, self.u_param, self.d_param, self.set_point)
+
+    def solve_batch(self, d_up, d_down, v_avail, q_out, u_params=None, d_params=None, set_points=None):
+        # ---- About ----
+        # Evaluate the market for T states and P parameter sets in one call.
+        # d_up: (T, n_agents), d_down, v_avail, q_out: (T, n_groups)
+        # u_params: (P, n_agents), d_params, set_points: (P, n_groups)
+        # Parameters not given are the market's own. Arrays in the returned
+        # dict are (P, T, n) if any parameter set is given, else (T, n).
+        if u_params is None and d_params is None and set_points is None:
+            return self.solve(d_up, d_down, v_avail, q_out)
+
+        def param_sets(x, own):
+            if x is None:
+                return own
+            # (P, n) -> (P, 1, n) to broadcast against the (T, n) states
+            return np.asarray(x, dtype=float)[:, np.newaxis, :]
+
+        u = param_sets(u_params, self.u_param)
+        dp = param_sets(d_params, self.d_param)
+        sp = param_sets(set_points, self.set_point)
+
+        # Make every output (P, T, n), even if eg. only set_points vary.
+        P = max(len(x) for x in [u_params, d_params, set_points] if x is not None)
+        T = np.shape(d_up)[0]
+        u = np.broadcast_to(u, (P, T, len(self.up_group)))
+        dp = np.broadcast_to(dp, (P, T, self.n_groups))
+        sp = np.broadcast_to(sp, (P, T, self.n_groups))
+
+        out = self.evaluate(d_up, d_down, v_avail, q_out, u, dp, sp)
+        # Qavail does not depend on the parameters
+        out['Qavail'] = np.broadcast_to(out['Qavail'], (P,) + out['Qavail'].shape)
+        return out
+
+    def evaluate(self, d_up, d_down, v_avail, q_out, u_param, d_param, set_point):
+        # Market quantities for states and parameters of any matching
+        # (broadcastable) shapes, agents/groups along the last axis.
+        d_up = np.maximum(np.asarray(d_up, dtype=float), 0.0)
+        d_down = np.asarray(d_down, dtype=float)
+        d_down = np.where(self.d_clamp & (d_down < 0.0), 0.0, d_down)
+        v_avail = np.asarray(v_avail, dtype=float)
+        q_out = np.asarray(q_out, dtype=float)
+
+        PW = d_up * u_param
+        Pwealth = self.group_sum(PW)
+        dcost = (d_down - set_point) * d_param
+
+        Pareto = (Pwealth + dcost) / self.tanks
+        Ppower = np.maximum(PW - Pareto[..., self.up_group], 0.0)
+
+        Qavail = v_avail / self.recommendation_time + q_out
+        q_goal = Qavail[..., self.up_group] * Ppower
+        v_goal = np.where(
+            self.v_from_q[self.up_group],
+            q_goal * self.recommendation_time,
+            v_avail[..., self.up_group] * Ppower
+        )
+
+        return {
+            'PW': PW,
+            'Pwealth': Pwealth,
+            'dcost': dcost,
+            'Pareto': Pareto,
+            'Ppower': Ppower,
+            'Qavail': Qavail,
+            'q_goal': q_goal,
+            'v_goal': v_goal,
+        }
@@ -12,22 +12,28 @@ obj_path = '/obj/path/'
 
 resource = 's3'
 
-def delete_obj(obj,bucket):
+def delete_obj(s3,obj,bucket):
     f = s3.Object(bucket,obj)
     f.delete()
     
     return
 
+def upload(s3=None):
+    # s3: boto3 resource to reuse, made here if not given
+    if s3 is None:
+        s3 = boto3.resource(resource)
+    glwa_bucket = s3.Bucket(bucket)
 
-s3 = boto3.resource(resource)
-glwa_bucket = s3.Bucket(bucket)
-img = open(obj_path + obj,'rb')
+    files = []
+    for file in glwa_bucket.objects.all():
+        files.append(file.key)
 
-files = []
-for file in glwa_bucket.objects.all():
-    files.append(file.key)
+    if obj in files:
+        delete_obj(s3,obj,bucket)
 
-if obj in files:
-    delete_obj(obj,bucket)
+    with open(obj_path + obj,'rb') as img:
+        s3.Bucket(bucket).put_object(Key=obj, Body=img, ACL='public-read')
 
-s3.Bucket(bucket).put_object(Key=obj, Body=img, ACL='public-read')
\ No newline at end of file
+
+if __name__ == '__main__':
+    upload()
@@ -9,42 +9,65 @@ import SystemAssets as SA
 import svgutils.transform as sg
 import datetime as dt
 
-# Establish InfluxDB Connection
-influx_client = SA.connection('PATH/TO/Influx_Connect_File.csv')
-# Bring in Fields To Query
-asset_fields = SA.get_asset_fields('PATH/TO/GLWA_infdb_data_structures.csv')
-
-# Pumpstation class needs: site_name, measure, query_fields
-fvw = SA.pumpstation('FVW','FAIRVIEW',asset_fields['FAIRVIEW'])
-con = SA.pumpstation('CON','CONNER',asset_fields['CONNER'])
-fre = SA.pumpstation('FRE','FREUD',asset_fields['FREUD'])
-
-add_to_base = []
-for ps in [con,fre,fvw]:
-    ps.pump_dict()
-    ps.pumps_recommended(influx_client)
+
+def recommended(influx_client, asset_fields, stations=None, assets=None):
+    # Build the recommended pump layer. Return the SVGFigure.
+    # stations: pumpstations returned by CombinedMBC.mbc() this cycle. Their
+    # pump recommendations are counted directly instead of queried back.
+    # assets: SA.registry to make the stations from if none are given.
     
-    for key in ps.recommended:
-        if ps.recommended[key] > 0:
-            fstr = 'GRAPHICS/{0}/REC/{1}/{2}.svg'.format(ps.measure,key,ps.recommended[key])
-            add_to_base.append(fstr)
+    if stations is None:
+        if assets is not None:
+            stations = assets.make('CON','FRE','FVW')
+        else:
+            # Pumpstation class needs: site_name, measure, query_fields
+            fvw = SA.pumpstation('FVW','FAIRVIEW',asset_fields['FAIRVIEW'])
+            con = SA.pumpstation('CON','CONNER',asset_fields['CONNER'])
+            fre = SA.pumpstation('FRE','FREUD',asset_fields['FREUD'])
             
+            stations = [con,fre,fvw]
+            for ps in stations:
+                ps.pump_dict()
+        
+        for ps in stations:
+            ps.pumps_recommended(influx_client, grouped=True)
+    else:
+        for ps in stations:
+            ps.count_recommended()
 
-build = sg.SVGFigure("19in","11.5in")
+    add_to_base = []
+    for ps in stations:
+        for key in ps.recommended:
+            if ps.recommended[key] > 0:
+                fstr = 'GRAPHICS/{0}/REC/{1}/{2}.svg'.format(ps.measure,key,ps.recommended[key])
+                add_to_base.append(fstr)
+                
 
-svg_list = []
+    build = sg.SVGFigure("19in","11.5in")
+
+    svg_list = []
+
+    for fstr in add_to_base:
+        layer = sg.fromfile(fstr)
+        layer = layer.getroot()
+        #layer.moveto(5,280)
+        svg_list.append(layer)
+        
+
+    t_str = "Rec Build Time: " + dt.datetime.utcnow().strftime("%m-%d %H:%M") + " UTC"
+    build_time = sg.TextElement(25,40,t_str,size=12,color='red')
+    svg_list.append(build_time)
+
+    # Make Rec Pump Layer 
+    build.append(svg_list)
+    return build
 
-for fstr in add_to_base:
-    layer = sg.fromfile(fstr)
-    layer = layer.getroot()
-    #layer.moveto(5,280)
-    svg_list.append(layer)
-    
 
-t_str = "Rec Build Time: " + dt.datetime.utcnow().strftime("%m-%d %H:%M") + " UTC"
-build_time = sg.TextElement(25,40,t_str,size=12,color='red')
-svg_list.append(build_time)
+if __name__ == '__main__':
+    # Establish InfluxDB Connection
+    influx_client = SA.connection('PATH/TO/Influx_Connect_File.csv')
+    # Bring in Fields To Query
+    asset_fields = SA.get_asset_fields('PATH/TO/GLWA_infdb_data_structures.csv')
 
-# Make Rec Pump Layer 
-build.append(svg_list)
-build.save('PATH/TO/GRAPHICS/recommended.svg')
\ No newline at end of file
+    build = recommended(influx_client, asset_fields)
+    build.save('PATH/TO/GRAPHICS/recommended.svg')
@@ -0,0 +1,51 @@
+# Description:  Resident version of command_queue.py. Runs the recommendation
+#               cycle (MBC -> latest -> recommended -> composite -> render -> upload)
+#               every 10 minutes from one long-running process.
+#
+#               The stages (see stages.py) run in-process, so numpy, influxdb,
+#               svgutils and boto3 are imported once, and the asset fields,
+#               influxDB client and s3 resource are made once and reused.
+#
+# Usage:        python recs_service.py          (run forever)
+#               python recs_service.py --once   (run one cycle and exit)
+
+import contextlib
+import os
+import sys
+import time
+
+import boto3
+import SystemAssets as SA
+import CombinedMBC
+import obj_to_s3
+import stages
+
+base_dir = '/home/ubuntu/RT_Recs'
+report_file = base_dir + '/_MBC_scripts_reports.txt'
+cycle = 600 # [sec]
+
+def run_cycle(graph):
+    with open(report_file, "a+") as out, contextlib.redirect_stdout(out):
+        results, codes = stages.run_graph(graph, out=out)
+    stages.report(codes, report_file)
+    return codes
+
+def main(once=False):
+    # stages use paths relative to the project directory
+    os.chdir(base_dir)
+    
+    client = SA.connection(CombinedMBC.connect_file)
+    asset_fields = SA.get_asset_fields(CombinedMBC.fields_file)
+    snapshot = SA.snapshot(CombinedMBC.snapshot_file)
+    s3 = boto3.resource(obj_to_s3.resource)
+    graph = stages.cycle_stages(client, asset_fields, snapshot, s3, base_dir)
+    
+    while True:
+        run_cycle(graph)
+        if once:
+            break
+        # sleep to the start of the next cycle
+        time.sleep(cycle - time.time() % cycle)
+
+if __name__ == '__main__':
+    main('--once' in sys.argv)
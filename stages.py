@@ -0,0 +1,129 @@
+# Description:  The recommendation cycle as a graph of in-process stages.
+#               Each stage is a function called with the results of the stages
+#               it depends on, so results are passed in memory instead of through
+#               influxDB and svg files. Independent stages (eg. latest and the MBC)
+#               run at the same time on a thread pool.
+
+import concurrent.futures
+import subprocess
+import traceback
+
+import SystemAssets as SA
+import CombinedMBC
+import latest
+import recommended
+import build_full_svg
+import obj_to_s3
+
+# Stage return codes
+OK = 0
+FAILED = 1
+SKIPPED = 2 # a dependency failed
+
+
+class stage():
+    # A named function and the names of the stages it depends on.
+    # func is called with the dependency results as keyword arguments.
+    # kwargs:
+    #   optional: names of stages to wait for, but run even if they failed
+    #             or were skipped. Their result is then None.
+    def __str__(self):
+        return self.name
+    
+    def __init__(self, name, func, *deps, **kwargs):
+        self.name = name
+        self.func = func
+        self.optional = tuple(kwargs.get('optional', ()))
+        self.deps = deps + self.optional
+
+
+def run_graph(graph, workers=4, out=None):
+    # Run every stage once all of its dependencies finished without error.
+    # Return (results, codes), both dicts keyed by stage name.
+    stages = {s.name: s for s in graph}
+    results = {}
+    codes = {}
+    running = {}
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        while len(codes) < len(stages):
+            for name,s in stages.items():
+                if name in codes or name in running.values():
+                    continue
+                required = [d for d in s.deps if d not in s.optional]
+                if any(codes.get(d) in (FAILED,SKIPPED) for d in required):
+                    codes[name] = SKIPPED
+                elif all(d in codes for d in s.deps):
+                    kwargs = {d: results.get(d) for d in s.deps}
+                    running[pool.submit(s.func, **kwargs)] = name
+            
+            if not running:
+                # everything left waits on a stage that is not in the graph
+                for name in stages:
+                    codes.setdefault(name,SKIPPED)
+                break
+            
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    codes[name] = OK
+                except Exception:
+                    traceback.print_exc(file=out)
+                    codes[name] = FAILED
+    
+    return results, codes
+
+
+def cycle_stages(client, asset_fields, snapshot, s3, base_dir='/home/ubuntu/RT_Recs'):
+    # Stages of one recommendation cycle:
+    # mbc, latest -> recommended -> composite -> render -> upload
+    # A failed MBC does not stop the dashboard: recommended then shows
+    # the last recommendations stored in influxDB.
+    assets = SA.get_registry(CombinedMBC.assets_file, asset_fields)
+    
+    def mbc():
+        return CombinedMBC.mbc(client, asset_fields, snapshot)
+    
+    def latest_layer():
+        return latest.latest(client, asset_fields, snapshot, assets)
+    
+    def recommended_layer(mbc):
+        # mbc is None if the MBC failed
+        return recommended.recommended(client, asset_fields, mbc, assets)
+    
+    def composite(latest, recommended):
+        build_full_svg.build_full_svg(latest, recommended)
+    
+    def render(composite):
+        cmd = 'inkscape --export-png={0}/GRAPHICS/base_latest_recommended.png {0}/GRAPHICS/base_latest_recommended.svg'.format(base_dir)
+        subprocess.run(cmd, shell=True, check=True)
+    
+    def upload(render):
+        obj_to_s3.upload(s3)
+    
+    return [
+        stage('mbc', mbc),
+        stage('latest', latest_layer),
+        stage('recommended', recommended_layer, optional=['mbc']),
+        stage('composite', composite, 'latest', 'recommended'),
+        stage('render', render, 'composite'),
+        stage('upload', upload, 'render'),
+    ]
+
+
+def report(codes, report_file):
+    # Push per-stage warnings to the report file.
+    warnings = []
+    for name,code in codes.items():
+        if code == FAILED:
+            warnings.append("Warning during: {0}".format(name))
+        elif code == SKIPPED:
+            warnings.append("Skipped: {0}".format(name))
+    
+    report = SA.report(report_file)
+    if warnings:
+        report.write(warnings)
+    else:
+        report.write(["No Warnings"])
@@ -1,15 +1,99 @@
 import math
-import pandas as pd
+import hashlib
+import importlib
+import os
+import pickle
 from collections import OrderedDict
-from pyswmm import Simulation
-import pyswmm
 import numpy as np
 import datetime
-import pytz
-import influxdb
+
+# Heavy dependencies are not imported with the module. Scripts that only
+# parse an .inp file never load them. They stay reachable as module
+# attributes (swmmAPI_v2.pyswmm, swmmAPI_v2.Simulation, ...) and are imported
+# on first access.
+_lazy_modules = {
+    'pd': 'pandas',
+    'pyswmm': 'pyswmm',
+    'pytz': 'pytz',
+    'influxdb': 'influxdb',
+}
+
+def __getattr__(name):
+    if name in _lazy_modules:
+        module = importlib.import_module(_lazy_modules[name])
+        globals()[name] = module
+        return module
+    if name == 'Simulation':
+        return __getattr__('pyswmm').Simulation
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+# SWMM output variables, in the order of the .out file
+node_keys = {'depth': 'Depth_above_invert',
+            'head': 'Hydraulic_head',
+            'volume': 'Volume_stored_ponded',
+            'inflow_lat': 'Lateral_inflow',
+            'flow': 'Total_inflow',
+            'flooding': 'Flow_lost_flooding'}
+link_keys = {'flow': 'Flow_rate',
+            'depth': 'Flow_depth',
+            'velocity': 'Flow_velocity',
+            'froude': 'Froude_number',
+            'cap': 'Capacity'}
 
 # CLASSES
 class swmmINP:
+    # Section dictionaries (self.conduits, self.pumps, ...) are built the
+    # first time they are used and then kept, see __getattr__. A control run
+    # that only needs pumps and storages never parses the other sections.
+
+    # attribute: methods that build it, in order
+    _builders = {
+        'xsections': ['make_xsec_dict'],
+        'curves': ['make_curves_dictionary'],
+        'conduits': ['make_conduit_dictionary','calc_slope','calc_qfull'],
+        'junctions': ['make_junction_dictionary'],
+        'storages': ['make_storage_dictionary'],
+        'subcatchments': ['make_subcatchment_dictionary'],
+        'outfalls': ['make_outfall_dictionary'],
+        'orifices': ['make_orifice_dictionary'],
+        'pumps': ['make_pump_dictionary'],
+        'options': ['make_options_dictionary'],
+        'raingauges': ['make_raingauges_dict'],
+        'timeseries': ['make_timeseries_dict'],
+        'evaporation': ['make_evap_dict'],
+        'infiltration': ['make_infiltration_dict'],
+        'losses': ['make_losses_dict'],
+        'controls': ['make_controls_dict'],
+        'inflows': ['make_inflows_dict'],
+        'Map': ['make_map_dict'],
+        'coords': ['make_coords_dict'],
+        'verts': ['make_verts_dict'],
+        'polygons': ['make_polygons_dict'],
+        'columns': ['make_columns'],
+    }
+    # attribute: attributes its values are derived from
+    _depends = {
+        'conduits': ['xsections','junctions','storages'],
+        'storages': ['curves'],
+        'pumps': ['curves'],
+        'columns': ['conduits','xsections','junctions','storages','outfalls'],
+    }
+
+    def __getattr__(self,name):
+        # Only called when the attribute is not set yet.
+        if name not in swmmINP._builders:
+            raise AttributeError("'swmmINP' object has no attribute '{0}'".format(name))
+        for method in swmmINP._builders[name]:
+            getattr(self,method)()
+        return self.__dict__[name]
+
+    def invalidate(self,name):
+        # Drop a built dictionary and everything derived from it. They are
+        # rebuilt on next use, eg. after changing self.offset or the min slope.
+        self.__dict__.pop(name,None)
+        for dependent,depends_on in swmmINP._depends.items():
+            if name in depends_on and dependent in self.__dict__:
+                self.invalidate(dependent)
     
     def __init__(self,inpF,*args,**kwargs):
         self.inpF = inpF
@@ -19,8 +103,14 @@ class swmmINP:
 
         # Handle keyword args.
         self.set_kwargs()
-            
-        self.make_sections()
+        
+        if self.cache_dir is None:
+            self.make_sections()
+        else:
+            self._cache_key = self.cache_key()
+            if not self.load_cache():
+                self.make_sections()
+                self.save_cache()
         # self.prep_dicts() # think this should be handled if you know what headers you have
         
     # SET
@@ -44,34 +134,64 @@ class swmmINP:
         if 'headers' in kw:
             self.headers = self.kwargs['headers']
 
-    def set_dicts(self):
-        self.make_xsec_dict()
-        self.make_curves_dictionary()
-        self.make_conduit_dictionary()
-        self.make_junction_dictionary()
-        self.make_storage_dictionary()
-        self.make_subcatchment_dictionary()
-        self.make_outfall_dictionary()
-        self.make_orifice_dictionary()
-        self.make_pump_dictionary()
-        self.make_options_dictionary()
-        self.make_raingauges_dict()
-        self.make_timeseries_dict()
-        self.make_evap_dict()
-        self.make_infiltration_dict()
-        self.make_losses_dict()
-        self.make_controls_dict()
-        self.make_inflows_dict()
-
+        # Directory for parsed model caches, see save_cache()
+        self.cache_dir = None
+        if 'cache_dir' in kw:
+            self.cache_dir = self.kwargs['cache_dir']
+
+    # CACHE
+    # With cache_dir set, the parsed sections and the dictionaries and
+    # derived values (slope, q_full, storage volumes, columns) built so far
+    # are pickled to cache_dir/<key>.pkl. The key hashes the .inp contents
+    # and the parser options, so an edited .inp or other options never load
+    # a stale cache. The first run saves the sections; call save_cache()
+    # again once more is built to keep that too.
+    _cache_version = 1
+    _not_cached = ['inpF','args','kwargs','cache_dir','_cache_key']
+
+    def cache_key(self):
+        h = hashlib.sha256()
+        with open(self.inpF,'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        options = (swmmINP._cache_version, self.offset, self._min_slope, tuple(self.headers))
+        h.update(repr(options).encode())
+        return h.hexdigest()
+
+    def cache_file(self):
+        # key hashed once, when the model was made
+        return os.path.join(self.cache_dir, self._cache_key + '.pkl')
+
+    def load_cache(self):
+        # Return True if the model was restored from the cache.
+        try:
+            with open(self.cache_file(),'rb') as f:
+                state = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return False
+        self.__dict__.update(state)
+        return True
+
+    def save_cache(self):
+        # Write what is built so far, nothing is built for the cache.
+        state = {k:v for k,v in self.__dict__.items() if k not in swmmINP._not_cached}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fn = self.cache_file()
+        tmp = fn + '.{0}.tmp'.format(os.getpid())
+        with open(tmp,'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, fn)
 
-        self.calc_slope()
-        self.calc_qfull()
+    def set_dicts(self):
+        # Build every section dictionary now rather than on first use.
+        for name in ['xsections','curves','conduits','junctions','storages',
+            'subcatchments','outfalls','orifices','pumps','options','raingauges',
+            'timeseries','evaporation','infiltration','losses','controls','inflows']:
+            getattr(self,name)
 
     def set_geo_dicts(self):
-        self.make_map_dict()
-        self.make_coords_dict()
-        self.make_verts_dict()
-        self.make_polygons_dict()
+        for name in ['Map','coords','verts','polygons']:
+            getattr(self,name)
 
     # MAKE
     def make_conduit_dictionary(self):
@@ -95,6 +215,9 @@ class swmmINP:
 
         self.calc_conduit_vol()
 
+    def make_columns(self):
+        self.columns = swmmColumns(self)
+
     def make_controls_dict(self):
         control_list = [l for l in self._sections['[CONTROLS]']]
         self.controls = {}
@@ -316,34 +439,30 @@ class swmmINP:
             }
 
     def make_sections(self):
-        with open(self.inpF) as f:
-            contents = f.read()
-        
+        # One pass over the file. Keeps the data lines of each section
+        # (comments, blank and indented lines dropped). Every header in
+        # self.headers gets a list, empty if the section is not in the file.
+        # Sections not in self.headers are kept too, under their own header.
         self._sections = {}
         for header in self.headers:
-            self._sections[header] = contents.find(header)
-            
-        sort = sorted(self._sections.items(), key=lambda x: x[1])
-        
-        for i in range(0,len(sort)):
-            if i < len(sort)-1:
-                a = [sort[i][1],sort[i+1][1]]
-            else:
-                a = [sort[i][1],len(contents)]
-                
-            section_content = contents[a[0]:a[1]]
-            h = section_content.split('\n')[0]
+            self._sections[header] = []
 
-            self._sections[h] = []
-            
-            for l in section_content.split('\n'):
+        section = None
+        with open(self.inpF) as f:
+            for l in f:
                 if not l:
-                    pass
+                    continue
                 elif l[0].isalnum():
-                    self._sections[h].append(l)
-                else:
-                    pass
-            
+                    if section is not None:
+                        section.append(l.rstrip('\r\n'))
+                elif l[0] == '[':
+                    # SWMM allows a comment after the header
+                    h = l.split(';',1)[0].strip()
+                    if h not in self._sections:
+                        self.warnings.append(h + ' section not in headers')
+                        self._sections[h] = []
+                    section = self._sections[h]
+
     def make_storage_dictionary(self):
         self.storages = {}
 
@@ -563,6 +682,281 @@ class swmmINP:
             else:
                 pass
 
+    def storage_curves(self,points=101):
+        # Depth and cumulative volume of every storage from 0 to its max
+        # depth, for SystemAssets.storage_curves. Volumes are exact at the
+        # table points: evenly spaced depths and the curve points below max
+        # depth. Return dict[name] = (depths, volumes).
+        curves = {}
+        for element,st in self.storages.items():
+            d = np.linspace(0.0, st['max_depth'], points)
+
+            if st['shape'] == 'FUNCTIONAL':
+                v = st['A'] * d**(st['B'] + 1) / (st['B'] + 1) + st['C'] * d
+
+            elif st['shape'] == 'TABULAR' and len(st['curve_info']['x_val']) > 1:
+                x = np.array(st['curve_info']['x_val'])
+                y = np.array(st['curve_info']['y_val'])
+                d = np.union1d(d, x[x < st['max_depth']])
+                # area linear in each curve interval, see calc_storage_vol
+                x_vol = np.array(st['curve_info']['vol'])
+                i = np.clip(np.searchsorted(x, d, 'right') - 1, 0, len(x) - 2)
+                dx = d - x[i]
+                slope = (y[i+1] - y[i]) / (x[i+1] - x[i])
+                v = x_vol[i] + y[i] * dx + slope * dx * dx / 2
+
+            else:
+                continue
+            curves[element] = (d.tolist(), v.tolist())
+        return curves
+
+class swmmColumns:
+    # Columnar view of the conduits and nodes of a swmmINP, built straight
+    # from the parsed sections (no per-element dicts). Element names map to
+    # integer ids (node_index, conduit_index), attributes are NumPy arrays
+    # indexed by id, and the calc_* methods are vectorized versions of the
+    # swmmINP ones with the same results.
+    # Use through swmmINP.columns, built on first use.
+
+    def __init__(self,model):
+        self.warnings = []
+        self._min_slope = model._min_slope
+        self.make_nodes(model._sections)
+        self.make_conduits(model._sections)
+
+        self.calc_xsec_area()
+        self.calc_conduit_vol()
+        self.calc_slope()
+        self.calc_qfull()
+
+    def make_nodes(self,sections):
+        # Junctions, then storages, then outfalls.
+        # node_type: 0 junction, 1 storage, 2 outfall
+        names = []
+        elevation = []
+        max_depth = []
+        node_type = []
+        for t,header in enumerate(['[JUNCTIONS]','[STORAGE]','[OUTFALLS]']):
+            for l in sections.get(header,[]):
+                a = l.split()
+                names.append(a[0])
+                elevation.append(float(a[1]))
+                max_depth.append(float(a[2]) if t < 2 else 0.0)
+                node_type.append(t)
+
+        self.node_names = names
+        self.node_index = {n:i for i,n in enumerate(names)}
+        self.node_elevation = np.array(elevation)
+        self.node_max_depth = np.array(max_depth)
+        self.node_type = np.array(node_type,dtype=np.int8)
+
+    def make_conduits(self,sections):
+        names = []
+        from_node = []
+        to_node = []
+        numbers = []
+        for l in sections['[CONDUITS]']:
+            a = l.split()
+            names.append(a[0])
+            from_node.append(self.node_index.get(a[1],-1))
+            to_node.append(self.node_index.get(a[2],-1))
+            numbers.append([float(x) for x in a[3:7]])
+
+        n = len(names)
+        numbers = np.array(numbers,dtype=float).reshape(n,4)
+        self.conduit_names = names
+        self.conduit_index = {c:i for i,c in enumerate(names)}
+        self.from_node = np.array(from_node,dtype=np.int64)
+        self.to_node = np.array(to_node,dtype=np.int64)
+        self.length = numbers[:,0]
+        self.roughness = numbers[:,1]
+        self.in_offset = numbers[:,2]
+        self.out_offset = numbers[:,3]
+
+        # Cross sections of the conduits (orifices etc. are skipped)
+        self.shape = np.full(n,'',dtype=object)
+        self.geom = np.zeros((n,4))
+        self.barrels = np.ones(n,dtype=np.int64)
+        for l in sections['[XSECTIONS]']:
+            a = l.split()
+            i = self.conduit_index.get(a[0])
+            if i is None:
+                continue
+            self.shape[i] = a[1]
+            self.geom[i] = [float(x) for x in a[2:6]]
+            # as make_xsec_dict: barrels only read with the culvert code given
+            if len(a) > 7:
+                self.barrels[i] = int(a[6])
+        self.geom1 = self.geom[:,0]
+        self.geom2 = self.geom[:,1]
+
+    # CALC
+    def calc_xsec_area(self):
+        self.area = np.ones(len(self.conduit_names))
+
+        circular = self.shape == 'CIRCULAR'
+        rect = (self.shape == 'RECT_CLOSED') | (self.shape == 'RECT_OPEN')
+        triangular = self.shape == 'TRIANGULAR'
+
+        self.area[circular] = (self.geom1[circular] / 2) ** 2 * math.pi * self.barrels[circular]
+        self.area[rect] = self.geom1[rect] * self.geom2[rect] * self.barrels[rect]
+        self.area[triangular] = 0.5 * self.geom1[triangular] * self.geom2[triangular] * self.barrels[triangular]
+
+        for i in np.flatnonzero(~(circular | rect | triangular)):
+            self.warnings.append(self.conduit_names[i] + ' ' + str(self.shape[i]) + ' not yet calculated area')
+
+    def calc_conduit_vol(self):
+        self.vol = self.area * self.length
+
+    def node_invert(self,nodes,offset):
+        # Invert + offset at the given node ids. Like swmmINP.calc_slope, only
+        # junctions and storages count; other ends are given the value 1.
+        known = (nodes >= 0)
+        known[known] = self.node_type[nodes[known]] < 2
+        e = np.ones(len(nodes))
+        e[known] = self.node_elevation[nodes[known]] + offset[known]
+        return e
+
+    def calc_slope(self):
+        e1 = self.node_invert(self.from_node,self.in_offset)
+        e2 = self.node_invert(self.to_node,self.out_offset)
+
+        self.slope = (e1 - e2) / self.length
+        self.slope_flag = (e1 == 1) | (e2 == 1) | (self.slope < self._min_slope)
+        self.slope[self.slope < self._min_slope] = self._min_slope
+
+    def calc_qfull(self):
+        self.q_full = np.ones(len(self.conduit_names))
+
+        c = self.shape == 'CIRCULAR'
+        self.q_full[c] = (self.geom1[c]**(8/3) * self.slope[c]**(1/2)) / (4**(5/3) * self.roughness[c]) * math.pi
+
+        r = self.shape == 'RECT_CLOSED'
+        g1 = self.geom1[r]
+        g2 = self.geom2[r]
+        self.q_full[r] = (1.49 / self.roughness[r]) * (0.95 * g1 * g2) * (g2 * 0.95 * g1 / (g2 + 2 * 0.95 * g1))**(2/3)
+
+class swmmOUT:
+    # SWMM binary output (.out) file, memory mapped. The header and element
+    # names are read once; results are read for many elements and variables
+    # at a time as strided columns of the (period, value) record array,
+    # without loading the file.
+    #
+    # Variables use the node_keys / link_keys names, either the short key
+    # ('depth') or the long name ('Depth_above_invert').
+    _magic = 516114522
+
+    def __init__(self,outF):
+        self.outF = outF
+        self.raw = np.memmap(outF, dtype=np.uint8, mode='r')
+
+        # closing records: positions, number of periods, error code, magic
+        id_pos, prop_pos, out_pos, self.periods, self.error, magic = self.ints(len(self.raw) - 24, 6)
+        if magic != swmmOUT._magic or self.ints(0, 1)[0] != swmmOUT._magic:
+            raise ValueError(outF + ' is not a SWMM output file')
+        if self.error != 0:
+            print(outF, 'SWMM run ended with error code', self.error)
+
+        self.version, self.flow_units, n_sub, n_node, n_link, n_pollut = self.ints(4, 6)
+
+        # element names
+        pos = id_pos
+        names = []
+        for i in range(n_sub + n_node + n_link + n_pollut):
+            n = self.ints(pos, 1)[0]
+            names.append(bytes(self.raw[pos+4:pos+4+n]).decode())
+            pos = pos + 4 + n
+        self.subcatch_names = names[:n_sub]
+        self.node_names = names[n_sub:n_sub+n_node]
+        self.link_names = names[n_sub+n_node:n_sub+n_node+n_link]
+        self.pollut_names = names[n_sub+n_node+n_link:]
+        self.node_index = {name: i for i,name in enumerate(self.node_names)}
+        self.link_index = {name: i for i,name in enumerate(self.link_names)}
+
+        # skip the input properties to the reporting variables
+        pos = prop_pos
+        for count in [n_sub, n_node, n_link]:
+            n_props = self.ints(pos, 1)[0]
+            pos = pos + 4 * (1 + n_props + count * n_props)
+        n_vars = []
+        for i in range(4):
+            n = self.ints(pos, 1)[0]
+            n_vars.append(n)
+            pos = pos + 4 * (1 + n)
+        self.sub_vars, self.node_vars, self.link_vars, self.sys_vars = n_vars
+
+        self.start = float(self.raw[pos:pos+8].view(np.float64)[0])
+        self.report_step = self.ints(pos + 8, 1)[0]
+
+        # results, one record per period: date (float64) then float32 values
+        self.record = 2 + n_sub * self.sub_vars + n_node * self.node_vars + n_link * self.link_vars + self.sys_vars
+        self.results = np.memmap(outF, dtype=np.float32, mode='r', offset=out_pos, shape=(self.periods, self.record))
+        self.node_start = 2 + n_sub * self.sub_vars
+        self.link_start = self.node_start + n_node * self.node_vars
+
+    def __str__(self):
+        return "swmmOUT: {0}, {1} periods, {2} nodes, {3} links".format(
+            self.outF, self.periods, len(self.node_names), len(self.link_names))
+
+    def ints(self,pos,n):
+        return [int(i) for i in self.raw[pos:pos+4*n].view(np.int32)]
+
+    def times(self,periods=None):
+        # Report times as datetime64[s], from the date of each record.
+        # SWMM dates are days since 1899-12-30.
+        if periods is None:
+            periods = slice(None)
+        days = np.ascontiguousarray(self.results[periods][:, :2]).view(np.float64)[:, 0]
+        seconds = np.round(days * 86400).astype('int64')
+        return np.datetime64('1899-12-30T00:00:00', 's') + seconds.astype('timedelta64[s]')
+
+    def var_index(self,measure,keys):
+        names = list(keys.values())
+        if measure in keys:
+            return names.index(keys[measure])
+        return names.index(measure)
+
+    def columns(self,el_type,names,measures):
+        # Record columns of each (name, measure) pair, names major
+        if el_type == 'link':
+            index, start, n_vars, keys = self.link_index, self.link_start, self.link_vars, link_keys
+        else:
+            index, start, n_vars, keys = self.node_index, self.node_start, self.node_vars, node_keys
+        el = np.array([index[n] for n in names])
+        var = np.array([self.var_index(m, keys) for m in measures])
+        return (start + el[:, np.newaxis] * n_vars + var[np.newaxis, :]).ravel()
+
+    def read(self,cols,periods=None):
+        # One strided read of the record columns, (periods, len(cols)).
+        # periods: slice of the report periods, default all
+        if periods is None:
+            periods = slice(None)
+        return np.asarray(self.results[periods][:, cols], dtype=float)
+
+    def nodes(self,names,measures,periods=None):
+        # Array (periods, len(names), len(measures))
+        cols = self.columns('node', names, measures)
+        return self.read(cols, periods).reshape(-1, len(names), len(measures))
+
+    def links(self,names,measures,periods=None):
+        # Array (periods, len(names), len(measures))
+        cols = self.columns('link', names, measures)
+        return self.read(cols, periods).reshape(-1, len(names), len(measures))
+
+    def extract(self,keys,periods=None):
+        # Columns for make_extract_string() keys, 'node,J1,Depth_above_invert'
+        # or 'link,C1,Flow_rate'. Array (periods, len(keys)).
+        cols = []
+        for key in keys:
+            el_type, name, measure = key.split(',')
+            cols.append(self.columns(el_type, [name], [measure])[0])
+        return self.read(np.array(cols, dtype=int), periods)
+
+    def close(self):
+        del self.results
+        del self.raw
+
+
 class system():
 
     def __init__(self, sim, *args, **kwargs):
@@ -590,6 +984,12 @@ class system():
         if 'control_step' in kw:
             self.control_step = self.kwargs['control_step']
 
+# Circular orifice: setting (open fraction of the diameter) and open area
+# as a fraction of the full area, theta the angle of the open segment.
+_circular_setting = np.linspace(0.0, 1.0, 201)
+_theta = 2.0 * np.arccos(1.0 - 2.0 * _circular_setting)
+_circular_area = (_theta - np.sin(_theta)) / (2.0 * math.pi)
+
 class ControlPoint:
     def __init__(self,line):
         self.c_name = line[0]
@@ -604,7 +1004,6 @@ class ControlPoint:
         self.location = line[8]
         self.group = int(line[9])
         
-        self.recommendations = []
         self.flood_el = float(line[7])
         self.flooding = False
         self.flood_count = 0.0
@@ -673,77 +1072,20 @@ class ControlPoint:
             # Weir Flow
             elif (f < 1.0 and H > 0.1):
                 A_open = self.q_goal / ( self.cmi['Cd'] * np.sqrt(2*run.g*H) * (2.0/3.0) )
-                
-                if self.cmi['shape'] == 'CIRCULAR':
-                    print(self.c_name)
-                    print("Circular does not work yet. Action = 0.0")
-                    self.action = 0.0
-                else:
-                    A_ratio = A_open / ( self.cmi['geom1'] * self.cmi['geom2'] )
-                    self.action = A_ratio
+                self.action = self.orifice_setting(A_open / self.area_full)
             
             # True orifice flow
             else:
                 # since q = Cd * A_open * sqrt( 2 g H )
                 A_open = self.q_goal / ( self.cmi['Cd'] * np.sqrt(2*run.g*H) )
-                
-                if self.cmi['shape'] == 'CIRCULAR':
-                    print(self.c_name)
-                    print("Circular does not work yet. Action = 0.0")
-                    self.action = 0.0
-                else:
-                    A_ratio = A_open / ( self.cmi['geom1'] * self.cmi['geom2'] )
-                    self.action = A_ratio
+                self.action = self.orifice_setting(A_open / self.area_full)
                     
 
         # Pump is true
         else: 
-            if self.cmi['curve_info']['type'] == 'PUMP1':
-                print(self.c_name, 'Pump type 1...')
-
-            elif self.cmi['curve_info']['type'] == 'PUMP2':
-                # q_out is a function of depth in wet well.
-                
-                # get q_full from depth
-                depth = upstream.depth
-                
-                q_full = 0.0
-                
-                n = len(self.cmi['curve_info']['x_val'])
-                for  l in range(n-1,-1,-1):
-                    # first index in the list. Can't find negative index.
-                    if l  == 0:
-                        if depth < self.cmi['curve_info']['x_val'][l]:
-                            q_full = self.cmi['curve_info']['y_val'][l]
-
-                    else:
-                        if depth < self.cmi['curve_info']['x_val'][l] and depth > self.cmi['curve_info']['x_val'][l-1]:
-                            q_full = self.cmi['curve_info']['y_val'][l]        
-
-            elif self.cmi['curve_info']['type'] == 'PUMP3':
-                head = h2 - h1 # pump pushes water from low head (h1) to higher head (h2)
-                
-                # x: Head
-                # y: Flow
-                # x = [float(j) for j in self.cmi['curve_info']['x_val']] 
-                # y = [float(j) for j in self.cmi['curve_info']['y_val']]
-                
-                if head > max(self.cmi['curve_info']['x_val']):
-                    head = max(self.cmi['curve_info']['x_val'])
-                elif head < min(self.cmi['curve_info']['x_val']):
-                    head = min(self.cmi['curve_info']['x_val'])
-
-                # calculate q_full at given head.
-                q_full = np.interp(
-                    head,
-                    np.array(self.cmi['curve_info']['x_val']),
-                    np.array(self.cmi['curve_info']['y_val']),
-                    )
-
-            elif self.cmi['curve_info']['type'] == 'PUMP4':
-                print(self.c_name, 'Pump type 4...')
+            q_full = self.pump_q_full(upstream, h1, h2)
             
-            if self.q_goal == 0.0:
+            if self.q_goal == 0.0 or q_full <= 0.0:
                 self.action = 0.0
             else:
                 self.action = self.q_goal / q_full 
@@ -755,13 +1097,63 @@ class ControlPoint:
         # print(self.c_name,self.c_var.target_setting)
         self.c_var.target_setting = self.action
 
+    def pump_q_full(self,upstream,h1,h2):
+        # Flow of the pump at full setting, from the curve compiled in
+        # compile_pump_curve(). Same lookups as SWMM:
+        #   PUMP1: steps of wet well volume
+        #   PUMP2: steps of wet well depth
+        #   PUMP3: interpolated on head, h2 - h1
+        #   PUMP4: interpolated on wet well depth
+        if self.curve_type == 'PUMP1':
+            return self.curve_y[min(np.searchsorted(self.curve_x, upstream.volume, 'right'), self.curve_n)]
+        elif self.curve_type == 'PUMP2':
+            return self.curve_y[min(np.searchsorted(self.curve_x, upstream.depth, 'right'), self.curve_n)]
+        elif self.curve_type == 'PUMP3':
+            # pump pushes water from low head (h1) to higher head (h2),
+            # heads outside the curve are clamped to its ends
+            return np.interp(h2 - h1, self.curve_x, self.curve_y)
+        elif self.curve_type == 'PUMP4':
+            return np.interp(upstream.depth, self.curve_x, self.curve_y)
+
+        print(self.c_name, self.curve_type, 'is not a pump curve')
+        return 0.0
+
+    def compile_pump_curve(self):
+        # Curve points as float arrays sorted on x, so that a control step
+        # is one searchsorted/interp.
+        curve = self.cmi['curve_info']
+        x = np.array(curve['x_val'], dtype=float)
+        y = np.array(curve['y_val'], dtype=float)
+        order = np.argsort(x, kind='stable')
+
+        self.curve_type = curve['type']
+        self.curve_x = x[order]
+        self.curve_y = y[order]
+        # last index, steps past the end of the curve keep its last flow
+        self.curve_n = len(x) - 1
+
+    def compile_orifice(self):
+        # Full open area of the orifice. Circular orifices are opened with
+        # the _circular_setting/_circular_area table.
+        if self.cmi['shape'] == 'CIRCULAR':
+            self.area_full = math.pi * self.cmi['geom1'] ** 2 / 4.0
+        else:
+            self.area_full = self.cmi['geom1'] * self.cmi['geom2']
+
+    def orifice_setting(self,A_ratio):
+        # Setting that opens A_ratio of the full orifice area.
+        if self.cmi['shape'] == 'CIRCULAR':
+            return np.interp(A_ratio, _circular_area, _circular_setting)
+        return A_ratio
+
     def check_flooding(self,run,nodes,links):
         self.flooding = False
 
-        if isinstance(self.u_var, pyswmm.nodes.Node):
+        # u_var is a pyswmm Node for junctions and storages, a Link for links
+        if self.u_type == 'junction' or self.u_type == 'storage':
             # get node elevation
             elev = self.u_var.depth + self.u_var.invert_elevation
-        elif isinstance(self.u_var, pyswmm.links.Link):
+        elif self.u_type == 'link':
             # get inlet node's elevation for the link
             elev =  nodes[self.u_var.inlet_node].depth + nodes[self.u_var.inlet_node].invert_elevation
         
@@ -776,10 +1168,10 @@ class ControlPoint:
 
         if self.c_type == 'pump':
             self.cmi = model.pumps[self.c_name]
-            self.cmi['curve_info']['x_val'] = [float(i) for i in self.cmi['curve_info']['x_val']]
-            self.cmi['curve_info']['y_val'] = [float(i) for i in self.cmi['curve_info']['y_val']]
+            self.compile_pump_curve()
         elif self.c_type == 'orifice':
             self.cmi = model.orifices[self.c_name]
+            self.compile_orifice()
 
         if self.u_type == 'storage':
             self.umi = model.storages[self.u_name]
@@ -797,11 +1189,225 @@ class ControlPoint:
             print(self.name, 'tryna get flow...')
         else:
             print(self.name, 'did not grab measure. Inspect')
-    
-    def rec_list(self,time_str):
-        rec_str = 'REC,site='+self.c_name+' '+'value='+str(self.action) + ' ' + time_str
-        self.recommendations.append(rec_str)
-        
+
+
+class Recorder:
+    # Actions, depths, flooding flags and q_goals of the ControlPoints, one
+    # row per recorded step, in arrays allocated up front (doubled if a
+    # simulation runs past n_steps). Nothing is formatted until export:
+    # lines() for InfluxDB line protocol, save() for a compressed .npz file.
+    def __init__(self,control_points,n_steps=1024):
+        self.points = control_points
+        self.names = np.array([c.c_name for c in control_points])
+        self.n = 0
+
+        shape = (max(int(n_steps), 1), len(control_points))
+        self.time = np.zeros(shape[0], dtype='datetime64[ns]')
+        self.action = np.zeros(shape)
+        self.depth = np.zeros(shape)
+        self.flooding = np.zeros(shape, dtype=bool)
+        self.q_goal = np.zeros(shape)
+
+    def __str__(self):
+        return "Recorder: {0} steps of {1} control points".format(self.n, len(self.names))
+
+    def __len__(self):
+        return self.n
+
+    def grow(self):
+        for name in ['time','action','depth','flooding','q_goal']:
+            a = getattr(self, name)
+            setattr(self, name, np.concatenate([a, np.zeros_like(a)]))
+
+    def record(self,t,action=None,depth=None,flooding=None,q_goal=None):
+        # One row at datetime t (UTC). Values not given are read from the
+        # points, eg. after ControlBank.step() only t is needed.
+        if self.n == len(self.time):
+            self.grow()
+        i = self.n
+        self.time[i] = np.datetime64(t, 'ns')
+        self.action[i] = [c.action for c in self.points] if action is None else action
+        self.depth[i] = [c.now for c in self.points] if depth is None else depth
+        self.flooding[i] = [c.flooding for c in self.points] if flooding is None else flooding
+        self.q_goal[i] = [c.q_goal for c in self.points] if q_goal is None else q_goal
+        self.n = i + 1
+
+    def lines(self,measurement='REC'):
+        # InfluxDB line protocol, one line per step and control point:
+        # REC,site=<c_name> value=<action>,depth=..,flooding=..,q_goal=.. <time ns>
+        times = self.time[:self.n].astype('int64').astype(str)
+        action = self.action[:self.n].astype(str)
+        depth = self.depth[:self.n].astype(str)
+        flooding = np.where(self.flooding[:self.n], 'true', 'false')
+        q_goal = self.q_goal[:self.n].astype(str)
+
+        lines = []
+        for j,name in enumerate(self.names):
+            head = measurement + ',site=' + name + ' value='
+            lines.extend([
+                head + a + ',depth=' + d + ',flooding=' + f + ',q_goal=' + q + ' ' + t
+                for t,a,d,f,q in zip(times, action[:,j], depth[:,j], flooding[:,j], q_goal[:,j])
+            ])
+        return lines
+
+    def save(self,fn):
+        # Compressed columnar file, read back with load_recorder()
+        np.savez_compressed(
+            fn,
+            names = self.names,
+            time = self.time[:self.n],
+            action = self.action[:self.n],
+            depth = self.depth[:self.n],
+            flooding = self.flooding[:self.n],
+            q_goal = self.q_goal[:self.n],
+        )
+
+
+class ControlBank:
+    # All ControlPoints of a simulation as arrays. step() does the work of
+    # get_target_setting and check_flooding for every point at once.
+    # Built after set_vars and get_model_info of each point.
+    def __init__(self,control_points,nodes):
+        self.points = control_points
+        n = len(control_points)
+
+        # nodes on both sides of the control element, and the node that floods
+        self.us_nodes = [nodes[c.c_var.connections[0]] for c in control_points]
+        self.ds_nodes = [nodes[c.c_var.connections[1]] for c in control_points]
+        self.flood_nodes = []
+        for c in control_points:
+            if c.u_type == 'link':
+                self.flood_nodes.append(nodes[c.u_var.inlet_node])
+            else:
+                self.flood_nodes.append(c.u_var)
+
+        self.us_invert = np.array([j.invert_elevation for j in self.us_nodes])
+        self.ds_invert = np.array([j.invert_elevation for j in self.ds_nodes])
+        self.flood_invert = np.array([j.invert_elevation for j in self.flood_nodes])
+        self.flood_el = np.array([c.flood_el for c in control_points])
+        self.flood_count = np.array([c.flood_count for c in control_points])
+
+        # Orifices
+        self.orifice = np.array([c.c_type != 'pump' for c in control_points], dtype=bool)
+        self.circular = np.zeros(n, dtype=bool)
+        self.geom1 = np.zeros(n)
+        self.Cd = np.ones(n)
+        self.crest = np.zeros(n)
+        self.area_full = np.ones(n)
+        for i in np.flatnonzero(self.orifice):
+            c = control_points[i]
+            self.circular[i] = c.cmi['shape'] == 'CIRCULAR'
+            self.geom1[i] = c.cmi['geom1']
+            self.Cd[i] = c.cmi['Cd']
+            self.crest[i] = c.cmi['offset']
+            self.area_full[i] = c.area_full
+        self.hcrest = self.us_invert + self.crest
+
+        # Pumps, curves padded to the longest one, and to at least 2 points
+        # for the interpolation. x pads are inf so they are never reached,
+        # y pads repeat the last flow.
+        self.pump = ~self.orifice
+        pumps = [control_points[i] for i in np.flatnonzero(self.pump)]
+        k = max([len(c.curve_x) for c in pumps] + [2])
+        self.curve_x = np.full((n, k), np.inf)
+        self.curve_y = np.zeros((n, k))
+        self.curve_n = np.zeros(n, dtype=int)
+        self.curve_type = np.array([''] * n, dtype=object)
+        for i in np.flatnonzero(self.pump):
+            c = control_points[i]
+            m = len(c.curve_x)
+            self.curve_x[i, :m] = c.curve_x
+            self.curve_y[i, :m] = c.curve_y
+            self.curve_y[i, m:] = c.curve_y[-1]
+            self.curve_n[i] = m - 1
+            self.curve_type[i] = c.curve_type
+        self.step_curve = (self.curve_type == 'PUMP1') | (self.curve_type == 'PUMP2')
+        self.by_volume = self.curve_type == 'PUMP1'
+        self.by_head = self.curve_type == 'PUMP3'
+        self.rows = np.arange(n)
+
+    def __str__(self):
+        return "ControlBank: {0} orifices, {1} pumps".format(self.orifice.sum(), self.pump.sum())
+
+    def curve_lookup(self,x):
+        # Full flow of each pump at x, see ControlPoint.pump_q_full
+        # step curves: first point past x, the last one if x is past the end
+        j = (self.curve_x <= x[:, np.newaxis]).sum(axis=1)
+        q_step = self.curve_y[self.rows, np.minimum(j, self.curve_n)]
+
+        # interpolated curves: clamped to the ends of the curve
+        first = self.curve_x[:, 0]
+        last = self.curve_x[self.rows, self.curve_n]
+        xc = np.clip(x, first, last)
+        j = np.clip((self.curve_x <= xc[:, np.newaxis]).sum(axis=1), 1, np.maximum(self.curve_n, 1))
+        x0, x1 = self.curve_x[self.rows, j-1], self.curve_x[self.rows, j]
+        y0, y1 = self.curve_y[self.rows, j-1], self.curve_y[self.rows, j]
+        # single point curves (x1 is a pad) and rows of orifices give y0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(np.isfinite(x1) & (x1 > x0), (xc - x0) / (x1 - x0), 0.0)
+        q_interp = y0 + t * (y1 - y0)
+
+        return np.where(self.step_curve, q_step, q_interp)
+
+    def target_settings(self,q_goal,setting,us_depth,ds_depth,us_volume,g):
+        # Target setting of every control point from the current states,
+        # before the flooding override. Arrays, one value per point.
+        h1 = us_depth + self.us_invert
+        h2 = ds_depth + self.ds_invert
+
+        # Orifices: weir or orifice regime, as ControlPoint.get_target_setting
+        current_height = setting * self.geom1
+        h_midpt = current_height / 2 + (self.us_invert + self.ds_invert) / 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f = np.where(h1 < current_height, (h1 - self.hcrest) / (current_height - self.hcrest), 1.0)
+            weir = f < 1.0
+            H = np.where(weir, h1 - self.hcrest, np.where(h2 < h_midpt, h1 - h_midpt, h1 - h2))
+            closed = (H < 0.1) | (f <= 0.0) | (h2 > h1)
+
+            # q = Cd * A_open * sqrt(2 g H), times 2/3 for weir flow
+            coef = self.Cd * np.sqrt(2 * g * np.maximum(H, 0.0)) * np.where(weir, 2.0/3.0, 1.0)
+            A_ratio = q_goal / coef / self.area_full
+        A_ratio = np.where(self.circular, np.interp(A_ratio, _circular_area, _circular_setting), A_ratio)
+        orifice_action = np.where(closed, 0.0, A_ratio)
+
+        # Pumps
+        x = np.where(self.by_head, h2 - h1, np.where(self.by_volume, us_volume, us_depth))
+        q_full = self.curve_lookup(x)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pump_action = np.where((q_goal == 0.0) | (q_full <= 0.0), 0.0, q_goal / q_full)
+
+        action = np.where(self.orifice, orifice_action, pump_action)
+        return np.clip(np.nan_to_num(action), 0.0, 1.0)
+
+    def step(self,run,q_goal=None):
+        # Set the target setting of every control point. q_goal: array of
+        # flow goals, default the points' q_goal. Flooding points are opened.
+        if q_goal is None:
+            q_goal = [c.q_goal for c in self.points]
+        q_goal = np.asarray(q_goal, dtype=float)
+
+        setting = np.array([c.c_var.current_setting for c in self.points])
+        us_depth = np.array([j.depth for j in self.us_nodes])
+        ds_depth = np.array([j.depth for j in self.ds_nodes])
+        # wet well volumes only for PUMP1 curves
+        us_volume = np.zeros(len(self.points))
+        for i in np.flatnonzero(self.by_volume):
+            us_volume[i] = self.us_nodes[i].volume
+        flood_depth = np.array([j.depth for j in self.flood_nodes])
+
+        action = self.target_settings(q_goal, setting, us_depth, ds_depth, us_volume, run.g)
+
+        flooding = flood_depth + self.flood_invert + run.offset > self.flood_el
+        action[flooding] = 1.0
+        self.flood_count = self.flood_count + flooding
+
+        for c,q,a,fl,fc in zip(self.points, q_goal, action, flooding, self.flood_count):
+            c.q_goal = q
+            c.action = a
+            c.flooding = fl
+            c.flood_count = fc
+            c.c_var.target_setting = a
+        return action
 
 class DownstreamPoint:
     def __init__(self,line):
@@ -844,6 +1450,55 @@ class DownstreamPoint:
             print(self.d_name,' did not grab measure. Inspect')
 
 
+# RUN
+def run_schedule(sim, run, control, report=None, *args, **kwargs):
+    # ---- About ----
+    # Drive a pyswmm Simulation. SWMM routes at its own routing step, but
+    # Python only wakes up every gcd(control_step, report_step) seconds
+    # (sim.step_advance), so the work between decisions is skipped.
+    #   control(t): called every run.control_step seconds of simulation
+    #               time, eg. solve the market and ControlBank.step()
+    #   report(t, dt): called every report_step seconds, dt the seconds
+    #               since the last call, eg. record states or accumulate volumes
+    # Steps of 0 (default) mean every routing step. Both are called on the
+    # first step. kwargs:
+    #   report_step [sec], default run.control_step
+    # Return the number of control decisions.
+    control_step = int(run.control_step)
+    report_step = int(kwargs.get('report_step', control_step))
+
+    if control_step > 0 and report_step > 0:
+        sim.step_advance(math.gcd(control_step, report_step))
+
+    def next_deadline(deadline, step, elapsed):
+        # Next time on the step grid after elapsed. Stays on the grid when a
+        # long routing step ran past one or more deadlines.
+        if step <= 0:
+            return deadline
+        return deadline + step * (math.floor((elapsed - deadline) / step) + 1)
+
+    start = last_report = sim.start_time
+    next_control = 0.0
+    next_report = 0.0
+    decisions = 0
+
+    for step in sim:
+        t = sim.current_time
+        elapsed = (t - start).total_seconds()
+
+        if elapsed >= next_control:
+            control(t)
+            decisions = decisions + 1
+            next_control = next_deadline(next_control, control_step, elapsed)
+
+        if report is not None and elapsed >= next_report:
+            report(t, (t - last_report).total_seconds())
+            last_report = t
+            next_report = next_deadline(next_report, report_step, elapsed)
+
+    return decisions
+
+
 # MAKE
 def make_control_points(fn):
     ControlPoints = []
@@ -941,27 +1596,19 @@ def push_meta(run,outF,ControlPoints,DownstreamPoints,derivative):
 
 
 def time_nano(dt):
+    import pytz
     epoch0 = datetime.datetime(1970,1,1)
     epoch0 = epoch0.replace(tzinfo = pytz.UTC)
 
     return str(int((dt.replace(tzinfo = pytz.UTC) - epoch0).total_seconds()*1000000000))   
 
+def load_recorder(fn):
+    # Arrays saved by Recorder.save(), as a dict
+    with np.load(fn) as f:
+        return {k: f[k] for k in f.files}
+
 # PLOTTTING Stuff
 def make_extract_string(name,el_type,measure):
-
-    node_keys = {'depth': 'Depth_above_invert',
-                'head': 'Hydraulic_head',
-                'volume': 'Volume_stored_ponded',
-                'inflow_lat': 'Lateral_inflow',
-                'flow': 'Total_inflow',
-                'flooding': 'Flow_lost_flooding'}
-    link_keys = {'flow': 'Flow_rate',
-                'depth': 'Flow_depth',
-                'velocity': 'Flow_velocity',
-                'froude': 'Froude_number',
-                'cap': 'Capacity'}
-        
-
     if el_type == 'storage' or el_type == 'junction':
         el_type = 'node'
         measure = node_keys[measure]
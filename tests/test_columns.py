@@ -0,0 +1,31 @@
+import os
+
+import numpy as np
+import pytest
+
+import swmmAPI_v2 as sw
+
+INP = os.path.join(os.path.dirname(__file__), 'data', 'small.inp')
+
+
+@pytest.mark.parametrize('key', ['slope', 'q_full', 'vol', 'area'])
+def test_columns_match_conduit_dicts(key):
+    model = sw.swmmINP(INP)
+    c = sw.swmmINP(INP).columns
+    expected = np.array([model.conduits[n][key] for n in c.conduit_names])
+    assert np.allclose(getattr(c, key), expected, rtol=1e-12, equal_nan=True)
+
+
+def test_columns_slope_flag_matches_conduit_dicts():
+    model = sw.swmmINP(INP)
+    c = sw.swmmINP(INP).columns
+    assert list(c.slope_flag) == [model.conduits[n]['slope_flag'] for n in c.conduit_names]
+
+
+@pytest.mark.parametrize('section', ['conduits', 'xsections', 'junctions', 'storages', 'outfalls'])
+def test_invalidate_drops_columns(section):
+    model = sw.swmmINP(INP)
+    first = model.columns
+    model.invalidate(section)
+    assert 'columns' not in model.__dict__
+    assert model.columns is not first
@@ -0,0 +1,79 @@
+import contextlib
+import io
+from types import SimpleNamespace as NS
+
+import numpy as np
+import pytest
+
+import swmmAPI_v2 as swmm
+
+
+def control_points(kinds, rng, curve_points=(1, 5)):
+    # Control points on fake pyswmm nodes and links.
+    # kinds: 'pump' or 'orifice' for each point
+    nodes = {}
+    links = {}
+    points = []
+    curve_types = ['PUMP1', 'PUMP2', 'PUMP3', 'PUMP4']
+    for i,kind in enumerate(kinds):
+        u, d = 'U{0}'.format(i), 'D{0}'.format(i)
+        nodes[u] = NS(depth=0.0, invert_elevation=rng.rand() * 5, volume=0.0)
+        nodes[d] = NS(depth=0.0, invert_elevation=rng.rand() * 5, volume=0.0)
+        links['C{0}'.format(i)] = NS(connections=(u, d), current_setting=0.0, target_setting=None)
+
+        u_type = ['storage', 'link', 'junction'][i % 3]
+        u_name = u
+        if u_type == 'link':
+            u_name = 'L{0}'.format(i)
+            links[u_name] = NS(inlet_node=u)
+
+        c = swmm.ControlPoint(['C{0}'.format(i), kind, '0', u_name, u_type, '1', 'depth',
+            str(8 + rng.rand() * 6), 'loc', '1', '0'])
+        c.set_vars(nodes, links)
+        if kind == 'pump':
+            m = rng.randint(curve_points[0], curve_points[1])
+            x = rng.rand(m) * 10
+            c.cmi = {'curve_info': {'type': curve_types[i // 2 % 4], 'x_val': list(x), 'y_val': list(rng.rand(m) * 20)}}
+            c.compile_pump_curve()
+        else:
+            c.cmi = {'shape': ['CIRCULAR', 'RECT_CLOSED'][i // 2 % 2], 'geom1': 1 + rng.rand() * 3,
+                'geom2': 2.0, 'Cd': 0.65, 'offset': rng.rand()}
+            c.compile_orifice()
+        points.append(c)
+    return points, nodes, links
+
+
+@pytest.mark.parametrize('kinds,curve_points', [
+    (['orifice', 'pump'] * 12, (1, 5)),
+    (['orifice'] * 6, (1, 5)),
+    (['pump'] * 6, (1, 2)),
+])
+def test_bank_matches_control_points(kinds, curve_points):
+    rng = np.random.RandomState(0)
+    points, nodes, links = control_points(kinds, rng, curve_points)
+    run = NS(g=32.2, offset=1.0)
+    bank = swmm.ControlBank(points, nodes)
+
+    flood_count = np.zeros(len(points))
+    for step in range(200):
+        for n in nodes.values():
+            n.depth = rng.rand() * 8
+            n.volume = rng.rand() * 12
+        for l in links.values():
+            l.current_setting = rng.rand()
+        q_goal = rng.rand(len(points)) * 10 * (rng.rand(len(points)) > 0.2)
+
+        # one point at a time, the old way
+        expected = []
+        for c,q,fc in zip(points, q_goal, flood_count):
+            c.q_goal = q
+            c.flood_count = fc
+            with contextlib.redirect_stdout(io.StringIO()):
+                c.get_target_setting(run, nodes, links)
+            expected.append(c.action)
+        flood_count = np.array([c.flood_count for c in points])
+
+        action = bank.step(run, q_goal)
+        np.testing.assert_allclose(action, expected)
+        np.testing.assert_array_equal(bank.flood_count, flood_count)
+        assert [l.target_setting for k,l in links.items() if k.startswith('C')] == list(action)
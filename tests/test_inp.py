@@ -0,0 +1,17 @@
+import os
+
+import swmmAPI_v2 as sw
+
+INP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'small.inp')
+
+
+def test_headers_with_comments(tmp_path):
+    with open(INP) as f:
+        text = f.read()
+    fn = str(tmp_path / 'commented.inp')
+    with open(fn, 'w') as f:
+        f.write(text.replace('[CONDUITS]', '[CONDUITS]  ;links').replace('[XSECTIONS]', '[XSECTIONS];shapes'))
+
+    model = sw.swmmINP(fn)
+    assert model.conduits == sw.swmmINP(INP).conduits
+    assert not [w for w in model.warnings if 'not in headers' in w]
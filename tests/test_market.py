@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+import market
+
+# Eastside configuration of CombinedMBC.recommend
+UP_GROUP = [0, 0, 0, 1, 1, 1, 2]
+U_PARAM = [0.097, 0.029, 0.684, 0.419, 1.0, 0.651, 0.459]
+D_PARAM = [0.588, 0.721, 0.373]
+SET_POINT = [0.062, 0.802, 0.921]
+KWARGS = dict(d_clamp=[True, False, False], v_from_q=[False, False, True], recommendation_time=600)
+
+
+def eastside(**params):
+    p = dict(u_param=U_PARAM, d_param=D_PARAM, set_point=SET_POINT)
+    p.update(params)
+    return market.market(UP_GROUP, p['u_param'], p['d_param'], p['set_point'], **KWARGS)
+
+
+def old_mbc(d_up, d_down, v_avail, q_out, u_param=U_PARAM, d_param=D_PARAM, set_point=SET_POINT):
+    # The per-group arithmetic CombinedMBC.mbc did before market.py
+    recommendation_time = 600
+    q_goal = np.zeros(len(UP_GROUP))
+    v_goal = np.zeros(len(UP_GROUP))
+    for g in range(3):
+        idx = [i for i, k in enumerate(UP_GROUP) if k == g]
+        d_norm = np.array([d_up[i] for i in idx])
+        d_norm[d_norm < 0] = 0.0
+        u_p = np.array([u_param[i] for i in idx])
+        tanks = len(u_p) + 1
+
+        PW = d_norm * u_p
+        d = d_down[g]
+        if g == 0 and d < 0.0:
+            d = 0.0
+        dcost = (d - set_point[g]) * d_param[g]
+        Pareto = (sum(PW) + dcost) / tanks
+        Ppower = PW - Pareto
+        Ppower[Ppower < 0] = 0
+
+        Qavail = v_avail[g] / recommendation_time + q_out[g]
+        q = Qavail * Ppower
+        v = q * recommendation_time if g == 2 else v_avail[g] * Ppower
+        q_goal[idx] = q
+        v_goal[idx] = v
+    return q_goal, v_goal
+
+
+def states(T, seed=0):
+    rng = np.random.RandomState(seed)
+    d_up = rng.uniform(-0.2, 1.2, (T, len(UP_GROUP)))
+    d_down = rng.uniform(-0.2, 1.2, (T, 3))
+    v_avail = rng.uniform(0.0, 2e6, (T, 3))
+    q_out = np.column_stack([np.zeros(T), rng.uniform(0, 500, T), rng.uniform(0, 500, T)])
+    return d_up, d_down, v_avail, q_out
+
+
+def test_solve_matches_old_loop():
+    m = eastside()
+    for s in zip(*states(50)):
+        out = m.solve(*s)
+        q_goal, v_goal = old_mbc(*s)
+        assert np.allclose(out['q_goal'], q_goal, rtol=1e-12, atol=0)
+        assert np.allclose(out['v_goal'], v_goal, rtol=1e-12, atol=0)
+
+
+def test_solve_batch_states_match_solve():
+    m = eastside()
+    d_up, d_down, v_avail, q_out = states(20, seed=1)
+    out = m.solve_batch(d_up, d_down, v_avail, q_out)
+    assert out['q_goal'].shape == (20, len(UP_GROUP))
+    for t in range(20):
+        one = m.solve(d_up[t], d_down[t], v_avail[t], q_out[t])
+        for k in one:
+            assert np.allclose(out[k][t], one[k], rtol=1e-12, atol=0), k
+
+
+@pytest.mark.parametrize('vary', [
+    ('u_param', 'd_param', 'set_point'),
+    ('set_point',),
+    ('u_param',),
+])
+def test_solve_batch_params_match_solve(vary):
+    P, T = 4, 6
+    rng = np.random.RandomState(2)
+    sets = {
+        'u_param': rng.uniform(0, 1, (P, len(UP_GROUP))),
+        'd_param': rng.uniform(0, 1, (P, 3)),
+        'set_point': rng.uniform(0, 1, (P, 3)),
+    }
+    given = {k: sets[k] for k in vary}
+    d_up, d_down, v_avail, q_out = states(T, seed=3)
+
+    out = eastside().solve_batch(
+        d_up, d_down, v_avail, q_out,
+        u_params=given.get('u_param'),
+        d_params=given.get('d_param'),
+        set_points=given.get('set_point'),
+    )
+    assert out['q_goal'].shape == (P, T, len(UP_GROUP))
+    assert out['Pareto'].shape == (P, T, 3)
+    assert out['Qavail'].shape == (P, T, 3)
+
+    for p in range(P):
+        m = eastside(**{k: v[p] for k, v in given.items()})
+        for t in range(T):
+            one = m.solve(d_up[t], d_down[t], v_avail[t], q_out[t])
+            for k in one:
+                assert np.allclose(out[k][p, t], one[k], rtol=1e-12, atol=0), k
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import SystemAssets as SA
+
+
+def circle_percent_area(h, depth_max):
+    # The scalar circular segment formula sewer_meter used before the tables
+    r = depth_max / 2
+    if h > r:
+        theta = 2 * np.arccos((r - (depth_max - h)) / r)
+        A = np.pi * r**2 - (r**2 * (theta - np.sin(theta))) / 2
+    else:
+        theta = 2 * np.arccos((r - h) / r)
+        A = (r**2 * (theta - np.sin(theta))) / 2
+    return A / (np.pi * r**2)
+
+
+def test_circular_matches_segment_formula():
+    depth_max = 11.0
+    h = np.linspace(0.0, depth_max, 501)
+    expected = [circle_percent_area(x, depth_max) for x in h]
+    np.testing.assert_allclose(SA.percent_full(h, depth_max), expected, atol=1e-5)
+
+
+def test_mixed_shapes():
+    pa = SA.percent_full([3.0, 3.0, 3.0, 6.0], 6.0, ['CIRCULAR', 'RECT', 'EGG', 'EGG'])
+    np.testing.assert_allclose(pa[:2], [0.5, 0.5])
+    assert 0.0 < pa[2] < 0.5        # egg is narrow at the invert
+    assert pa[3] == pytest.approx(1.0)
+
+    area = SA.area_full([2.0, 2.0, 3.0], ['CIRCULAR', 'RECT', 'EGG'], [2.0, 5.0, 3.0])
+    np.testing.assert_allclose(area, [np.pi, 10.0, 0.5105 * 9.0], rtol=1e-3)
+
+
+def test_unknown_shape_raises():
+    with pytest.raises(ValueError, match='CIRCLE'):
+        SA.percent_full([1.0, 1.0], 2.0, ['CIRCULAR', 'CIRCLE'])
+    with pytest.raises(ValueError, match='HORSESHOE'):
+        SA.area_full(2.0, 'HORSESHOE')
@@ -0,0 +1,112 @@
+import copy
+import json
+import os
+
+import pytest
+
+import SystemAssets as SA
+
+here = os.path.dirname(os.path.abspath(__file__))
+csv_dir = os.path.join(os.path.dirname(here), 'csv')
+assets_file = os.path.join(csv_dir, 'eastside_assets.json')
+
+
+@pytest.fixture
+def asset_fields():
+    return SA.get_asset_fields(os.path.join(csv_dir, 'GLWA_infdb_data_structures.csv'))
+
+
+def hand_built(asset_fields):
+    # The Eastside assets as CombinedMBC.make_assets built them by hand
+    con = SA.pumpstation('CON','CONNER',asset_fields['CONNER'])
+    fre = SA.pumpstation('FRE','FREUD',asset_fields['FREUD'])
+    fvw = SA.pumpstation('FVW','FAIRVIEW',asset_fields['FAIRVIEW'])
+    CC_BF = SA.cso_basin('CONNERS_CREEK','CSO_BASIN',asset_fields['CSO_BASIN'])
+    DRI = SA.sewer_meter('DT_S_8_DRI@JEFFERSONIAN_APT','SEWER_METER',asset_fields['SEWER_METER'])
+
+    con.invert = (44.50,55.0)
+    con.depth_max = (50,40)
+    con.flood_el = (95.0,)
+    con.wet_wells = (2,)
+    fre.invert = (13.0,)
+    fre.depth_max = (75.4,)
+    fre.flood_el = (84.0,)
+    fre.wet_wells = (1,)
+    fvw.invert = (0,)
+    fvw.depth_max = (37,)
+    fvw.flood_el = (96.0,)
+    fvw.wet_wells = (1,)
+    CC_BF.to_normalize = ('FOREBAY_LEVEL','BASIN_LEVEL')
+    CC_BF.max_depth = (17.5,22.0)
+    CC_BF.invert = (76.3,78.0)
+    DRI.depth_max = 11.0
+    DRI.length = 1796
+    DRI.set_type = 'LEVEL'
+
+    con.u_param = {'ST' : (0.097,), 'SN' : (0.651,)}
+    fre.u_param = {'ST' : (0.029,), 'SN' : (1.0,)}
+    fvw.u_param = {'SN' : (0.459,)}
+    CC_BF.u_param = {'FORE_1' : (0.684,), 'FORE_2' : (1.0,), 'BASIN' : (0.419,)}
+    CC_BF.set_point = (0.062,)
+    CC_BF.d_param = (0.588,)
+    fvw.d_param = (0.721,)
+    fvw.set_point = (0.802,)
+    DRI.set_point = (0.921,)
+    DRI.d_param = (0.373,)
+
+    for ps in [con,fre,fvw]:
+        with open(os.path.join(csv_dir, '{0}_PUMP_FLOWS.csv'.format(ps.measure))) as f:
+            ps.pump_dict([l.strip().split(',') for l in f])
+    return [con, fre, fvw, CC_BF, DRI]
+
+
+def state(a):
+    # Attributes of an asset, tuples as lists, pumps as tuples
+    d = {}
+    for k,v in vars(a).items():
+        if k in ('pumps', 'groups', 'kwargs'):
+            continue
+        if isinstance(v, tuple):
+            v = list(v)
+        if k == 'u_param':
+            v = {p: list(u) for p,u in v.items()}
+        d[k] = v
+    pumps = [(p.name, p.flowrate, p.group) for p in getattr(a, 'pumps', {}).values()]
+    return d, pumps
+
+
+def test_registry_matches_hand_built_assets(asset_fields):
+    assets = SA.registry(assets_file, asset_fields)
+    made = assets.make('CON', 'FRE', 'FVW', 'CONNERS_CREEK', 'DT_S_8_DRI@JEFFERSONIAN_APT')
+    for a,b in zip(made, hand_built(asset_fields)):
+        assert state(a) == state(b)
+
+    assert isinstance(assets.make('CON'), list)
+    assert assets.make_one('CON').name == 'CON'
+    assert [a.name for a in assets.group(3)] == ['FVW', 'DT_S_8_DRI@JEFFERSONIAN_APT']
+    assert [a.name for a in assets.measure('CONNER')] == ['CON']
+
+
+def write_config(tmp_path, change):
+    with open(assets_file) as f:
+        config = json.load(f)
+    change({a['site']: a for a in config['assets']})
+    fn = str(tmp_path / 'assets.json')
+    with open(fn, 'w') as f:
+        json.dump(config, f)
+    return fn
+
+
+@pytest.mark.parametrize('change,message', [
+    (lambda c: c['CON'].pop('site'), 'asset 0: no site'),
+    (lambda c: c['CON']['attributes'].pop('invert'), 'CON: no attribute invert'),
+    (lambda c: c['CON']['attributes'].update(wet_wells=[3]), 'CON: invert for 3 wet wells'),
+    (lambda c: c['FRE'].pop('pumps'), 'FRE: no pumps'),
+    (lambda c: c['CONNERS_CREEK']['attributes'].update(max_depth=[17.5]), 'CONNERS_CREEK: to_normalize'),
+    (lambda c: c['DT_S_8_DRI@JEFFERSONIAN_APT'].update(kwargs={'shape': 'CIRCLE'}), 'unknown shape CIRCLE'),
+    (lambda c: c['DT_S_8_DRI@JEFFERSONIAN_APT']['attributes'].update(depth_max='11'), 'depth_max is not a positive number'),
+])
+def test_bad_config_fails_on_load(tmp_path, asset_fields, change, message):
+    fn = write_config(tmp_path, change)
+    with pytest.raises(ValueError, match=message):
+        SA.get_registry(fn, asset_fields)
@@ -0,0 +1,83 @@
+import os
+
+import SystemAssets as SA
+
+
+class recording_client():
+    # Stands in for the influxDB client, keeps the lines written
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.lines = []
+
+    def write_points(self, points, protocol='line'):
+        if self.fail:
+            raise IOError('connection lost')
+        self.lines.extend(points)
+        return True
+
+
+def goal_lines():
+    # FLOW_REC and VOLUME_REC lines of one asset, as CombinedMBC writes them
+    a = SA.cso_basin('CONNERS_CREEK', 'CSO_BASIN', ['BASIN_LEVEL'])
+    a.q_goal = {'BASIN': ['2019-05-11T00:50:00Z', 12.5, 2]}
+    a.v_goal = {'BASIN': ['2019-05-11T00:50:00Z', 7500.0, 2]}
+
+    client = recording_client()
+    a.write_goals(client, 'FLOW_REC')
+    a.write_goals(client, 'VOLUME_REC')
+    return client.lines
+
+
+def test_replay_keeps_every_field_of_a_point(tmp_path):
+    lines = goal_lines()
+    assert len(lines) == 2
+
+    spool = SA.spool(str(tmp_path / 'spool.gz'))
+    spool.append(lines)
+
+    client = recording_client()
+    assert spool.replay(client, retries=0) == []
+
+    assert len(client.lines) == 1
+    fields = spool.split_fields(client.lines[0])
+    keys = [f.split('=', 1)[0] for f in fields]
+    assert 'FLOW_REC' in keys
+    assert 'VOLUME_REC' in keys
+    assert 'FLOW_REC=12.5' in fields
+    assert 'VOLUME_REC=7500.0' in fields
+
+
+def test_later_value_of_a_field_wins(tmp_path):
+    spool = SA.spool(str(tmp_path / 'spool.gz'))
+    spool.append([
+        'M,SITE=A X=1,S="a, b c" 100',
+        'M,SITE=B X=5 100',
+        'M,SITE=A X=2 100',
+    ])
+    assert spool.read() == [
+        'M,SITE=B X=5 100',
+        'M,SITE=A X=2,S="a, b c" 100',
+    ]
+
+
+def test_failed_replay_stays_spooled(tmp_path):
+    spool = SA.spool(str(tmp_path / 'spool.gz'))
+    spool.append(goal_lines())
+
+    fails = spool.replay(recording_client(fail=True), retries=0)
+    assert len(fails) == 1
+    assert spool.read() == fails
+
+
+def test_stray_files_next_to_the_spool_are_ignored(tmp_path):
+    fn = str(tmp_path / 'spool.gz')
+    spool = SA.spool(fn)
+    spool.append(['M,SITE=A X=1 100'])
+    for stray in ['.tmp', '.bak', '.100~']:
+        open(fn + stray, 'w').close()
+    rotated = fn + '.100'
+    os.replace(fn, rotated)
+    spool.append(['M,SITE=A X=2 200'])
+
+    assert spool.files() == [rotated, fn]
+    assert spool.read() == ['M,SITE=A X=1 100', 'M,SITE=A X=2 200']
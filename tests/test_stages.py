@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+import SystemAssets as SA
+import CombinedMBC
+import stages
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+csv_dir = os.path.join(root, 'csv')
+
+
+@pytest.fixture
+def cycle(tmp_path, monkeypatch):
+    # The stages use paths relative to the project directory, as recs_service.py
+    monkeypatch.chdir(root)
+    monkeypatch.setattr(CombinedMBC, 'assets_file', os.path.join(csv_dir, 'eastside_assets.json'))
+    asset_fields = SA.get_asset_fields(os.path.join(csv_dir, 'GLWA_infdb_data_structures.csv'))
+    assets = SA.get_registry(CombinedMBC.assets_file, asset_fields)
+
+    # Snapshot of the stations with pump ST1 at Conner running, so no
+    # stage needs to query influxDB. SN9 at Conner is recommended on.
+    snapshot = SA.snapshot(str(tmp_path / 'snapshot.json'))
+    stations = assets.make('CON','FRE','FVW')
+    for ps in stations:
+        fields = {f: ['2019-01-01T00:00:00Z', 0] for f in ps.fields}
+        if ps.measure == 'CONNER':
+            fields['ST1'] = ['2019-01-01T00:00:00Z', 1]
+        snapshot.assets[snapshot.key(ps)] = fields
+    snapshot.save()
+
+    for ps in stations:
+        for p in ps.pumps:
+            ps.pumps[p].rec = {'REC_BOOL': (ps.measure, p) == ('CONNER', 'SN9')}
+
+    graph = stages.cycle_stages(None, asset_fields, snapshot, None)
+    graph = [s for s in graph if s.name in ('latest', 'recommended')]
+    # the MBC of this cycle, already done
+    graph.append(stages.stage('mbc', lambda: stations))
+    return graph
+
+
+def test_layers_run_with_a_pump_on(cycle):
+    results, codes = stages.run_graph(cycle)
+    assert codes == {'latest': stages.OK, 'recommended': stages.OK, 'mbc': stages.OK}
+
+    # one running/recommended layer and the build time text each
+    assert len(results['latest'].root[0]) == 2
+    assert len(results['recommended'].root[0]) == 2
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pytest
+
+import SystemAssets as SA
+import CombinedMBC
+import swmmAPI_v2 as sw
+
+here = os.path.dirname(os.path.abspath(__file__))
+csv_dir = os.path.join(os.path.dirname(here), 'csv')
+INP = os.path.join(here, 'data', 'small.inp')
+
+
+@pytest.fixture
+def stations():
+    asset_fields = SA.get_asset_fields(os.path.join(csv_dir, 'GLWA_infdb_data_structures.csv'))
+    assets = SA.get_registry(os.path.join(csv_dir, 'eastside_assets.json'), asset_fields)
+    return assets.make('CONNERS_CREEK', 'FVW')
+
+
+def test_saved_node_curves_are_used_under_the_asset_names(tmp_path, monkeypatch, capsys, stations):
+    CC_BF, fvw = stations
+    model = SA.storage_curves(sw.swmmINP(INP).storage_curves())
+    fn = str(tmp_path / 'storage_curves.json')
+    model.save(fn, names={'S1': CC_BF.name})
+    monkeypatch.setattr(CombinedMBC, 'storage_file', fn)
+
+    curves = CombinedMBC.storage_curves(CC_BF, fvw)
+    assert np.allclose(curves.curves[CC_BF.name][1], model.curves['S1'][1])
+    # not in the file: prismatic, with a warning
+    assert curves.max_volume(fvw.name) == pytest.approx(1000.0 * fvw.depth_max[0])
+    out = capsys.readouterr().out
+    assert 'no curve for FVW' in out
+    assert CC_BF.name not in out
+
+
+def test_save_unknown_node_fails(tmp_path):
+    model = SA.storage_curves(sw.swmmINP(INP).storage_curves())
+    with pytest.raises(ValueError, match='NOPE'):
+        model.save(str(tmp_path / 'storage_curves.json'), names={'NOPE': 'FVW'})
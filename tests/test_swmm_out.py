@@ -0,0 +1,114 @@
+import struct
+
+import numpy as np
+import pytest
+
+import swmmAPI_v2 as sw
+
+MAGIC = 516114522
+SUBS = ['S1']
+NODES = ['J1', 'J2', 'O1']
+LINKS = ['C1', 'C2']
+# reporting variables per element type, as SWMM 5.1
+N_SUB, N_NODE, N_LINK, N_SYS = 8, 6, 5, 15
+PERIODS = 2
+START = 43831.0 # 2020-01-01, days since 1899-12-30
+STEP = 300
+
+
+def value(period, column):
+    # Every result is its own period and record column, exact in float32
+    return period * 1000.0 + column
+
+
+def write_out(fn):
+    # A small SWMM 5.1 binary output file: opening records, element ids,
+    # input properties, reporting variable codes, start date and report
+    # step, the result records, and the closing records.
+    b = bytearray(struct.pack('7i', MAGIC, 51000, 0, len(SUBS), len(NODES), len(LINKS), 0))
+
+    id_pos = len(b)
+    for name in SUBS + NODES + LINKS:
+        b += struct.pack('i', len(name)) + name.encode()
+
+    prop_pos = len(b)
+    b += struct.pack('2i', 1, 1) + np.zeros(len(SUBS), 'f4').tobytes()
+    b += struct.pack('4i', 3, 0, 2, 3) + np.zeros(len(NODES) * 3, 'f4').tobytes()
+    b += struct.pack('6i', 5, 0, 4, 4, 4, 3) + np.zeros(len(LINKS) * 5, 'f4').tobytes()
+    for n in [N_SUB, N_NODE, N_LINK, N_SYS]:
+        b += struct.pack('i', n) + struct.pack('{0}i'.format(n), *range(n))
+    b += struct.pack('d', START) + struct.pack('i', STEP)
+
+    out_pos = len(b)
+    n_values = len(SUBS) * N_SUB + len(NODES) * N_NODE + len(LINKS) * N_LINK + N_SYS
+    for t in range(PERIODS):
+        # date takes the first two float32 columns of a record
+        values = [value(t, 2 + i) for i in range(n_values)]
+        b += struct.pack('d', START + (t + 1) * STEP / 86400.0) + np.array(values, 'f4').tobytes()
+
+    b += struct.pack('6i', id_pos, prop_pos, out_pos, PERIODS, 0, MAGIC)
+    with open(fn, 'wb') as f:
+        f.write(b)
+
+
+@pytest.fixture
+def out(tmp_path):
+    fn = str(tmp_path / 'small.out')
+    write_out(fn)
+    out = sw.swmmOUT(fn)
+    yield out
+    out.close()
+
+
+def node_column(node, var):
+    return 2 + len(SUBS) * N_SUB + NODES.index(node) * N_NODE + var
+
+
+def link_column(link, var):
+    return 2 + len(SUBS) * N_SUB + len(NODES) * N_NODE + LINKS.index(link) * N_LINK + var
+
+
+def test_header(out):
+    assert out.periods == PERIODS
+    assert out.node_names == NODES
+    assert out.link_names == LINKS
+    assert (out.sub_vars, out.node_vars, out.link_vars, out.sys_vars) == (N_SUB, N_NODE, N_LINK, N_SYS)
+    assert out.report_step == STEP
+    assert out.record == 2 + len(SUBS) * N_SUB + len(NODES) * N_NODE + len(LINKS) * N_LINK + N_SYS
+    assert out.node_start == node_column('J1', 0)
+    assert out.link_start == link_column('C1', 0)
+
+
+def test_times(out):
+    assert list(out.times()) == [
+        np.datetime64('2020-01-01T00:05:00'),
+        np.datetime64('2020-01-01T00:10:00'),
+    ]
+
+
+def test_node_and_link_series(out):
+    nodes = out.nodes(['J2', 'O1'], ['depth', 'Total_inflow'])
+    assert nodes.shape == (PERIODS, 2, 2)
+    for t in range(PERIODS):
+        assert nodes[t, 0, 0] == value(t, node_column('J2', 0))
+        assert nodes[t, 0, 1] == value(t, node_column('J2', 4))
+        assert nodes[t, 1, 0] == value(t, node_column('O1', 0))
+        assert nodes[t, 1, 1] == value(t, node_column('O1', 4))
+
+    links = out.links(['C2'], ['flow', 'cap'], periods=slice(1, 2))
+    assert links.shape == (1, 1, 2)
+    assert links[0, 0, 0] == value(1, link_column('C2', 0))
+    assert links[0, 0, 1] == value(1, link_column('C2', 4))
+
+    extract = out.extract(['node,J1,Hydraulic_head', 'link,C1,Flow_velocity'])
+    assert extract.tolist() == [
+        [value(t, node_column('J1', 1)), value(t, link_column('C1', 2))] for t in range(PERIODS)
+    ]
+
+
+def test_not_an_out_file(tmp_path):
+    fn = str(tmp_path / 'bad.out')
+    with open(fn, 'wb') as f:
+        f.write(b'\0' * 64)
+    with pytest.raises(ValueError):
+        sw.swmmOUT(fn)